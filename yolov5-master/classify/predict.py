@@ -83,6 +83,7 @@ def run(
     half=False,  # use FP16 half-precision inference
     dnn=False,  # use OpenCV DNN for ONNX inference
     vid_stride=1,  # video frame-rate stride
+    batch_size=1,  # batch size for image files and directories
 ):
     source = str(source)
     save_img = not nosave and not source.endswith(".txt")  # save inference images
@@ -112,7 +113,9 @@ def run(
     elif screenshot:
         dataset = LoadScreenshots(source, img_size=imgsz, stride=stride, auto=pt)
     else:
-        dataset = LoadImages(source, img_size=imgsz, transforms=classify_transforms(imgsz[0]), vid_stride=vid_stride)
+        bs = batch_size
+        transforms = classify_transforms(imgsz[0])
+        dataset = LoadImages(source, img_size=imgsz, transforms=transforms, vid_stride=vid_stride, batch_size=bs)
     vid_path, vid_writer = [None] * bs, [None] * bs
 
     # Run inference
@@ -136,7 +139,7 @@ def run(
         # Process predictions
         for i, prob in enumerate(pred):  # per image
             seen += 1
-            if webcam:  # batch_size >= 1
+            if isinstance(path, list):  # batch_size >= 1
                 p, im0, frame = path[i], im0s[i].copy(), dataset.count
                 s += f"{i}: "
             else:
@@ -223,6 +226,7 @@ def parse_opt():
     parser.add_argument("--half", action="store_true", help="use FP16 half-precision inference")
     parser.add_argument("--dnn", action="store_true", help="use OpenCV DNN for ONNX inference")
     parser.add_argument("--vid-stride", type=int, default=1, help="video frame-rate stride")
+    parser.add_argument("--batch-size", type=int, default=1, help="batch size for image files and directories")
     opt = parser.parse_args()
     opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
     print_args(vars(opt))
@@ -29,7 +29,7 @@ Usage - formats:
 """
 
 import argparse
-import csv
+import json
 import os
 import platform
 import sys
@@ -46,10 +46,13 @@ ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 from ultralytics.utils.plotting import Annotator, colors, save_one_box
 
 from models.common import DetectMultiBackend
+from utils import threaded_iterator
 from utils.dataloaders import IMG_FORMATS, VID_FORMATS, LoadImages, LoadScreenshots, LoadStreams
 from utils.general import (
     LOGGER,
+    NMS_METHODS,
     Profile,
+    ResultsWriter,
     check_file,
     check_img_size,
     check_imshow,
@@ -79,11 +82,13 @@ def run(
     view_img=False,  # show results
     save_txt=False,  # save results to *.txt
     save_csv=False,  # save results in CSV format
+    save_json=False,  # save results in JSON-lines format
     save_conf=False,  # save confidences in --save-txt labels
     save_crop=False,  # save cropped prediction boxes
     nosave=False,  # do not save images/videos
     classes=None,  # filter by class: --class 0, or --class 0 2 3
     agnostic_nms=False,  # class-agnostic NMS
+    nms_method="hard",  # NMS method, hard, merge, soft or wbf
     augment=False,  # augmented inference
     visualize=False,  # visualize features
     update=False,  # update all models
@@ -96,6 +101,9 @@ def run(
     half=False,  # use FP16 half-precision inference
     dnn=False,  # use OpenCV DNN for ONNX inference
     vid_stride=1,  # video frame-rate stride
+    batch_size=1,  # batch size for image files and directories
+    ov_async=False,  # keep several OpenVINO infer requests in flight
+    pipeline=False,  # overlap decode, inference and saving on threads
 ):
     source = str(source)
     save_img = not nosave and not source.endswith(".txt")  # save inference images
@@ -103,6 +111,8 @@ def run(
     is_url = source.lower().startswith(("rtsp://", "rtmp://", "http://", "https://"))
     webcam = source.isnumeric() or source.endswith(".streams") or (is_url and not is_file)
     screenshot = source.lower().startswith("screen")
+    assert not (ov_async and (augment or visualize)), "--ov-async is not compatible with --augment or --visualize"
+    assert not (visualize and batch_size > 1), "--visualize saves one image per forward, use --batch-size 1"
     if is_url and is_file:
         source = check_file(source)  # download
 
@@ -125,71 +135,81 @@ def run(
     elif screenshot:
         dataset = LoadScreenshots(source, img_size=imgsz, stride=stride, auto=pt)
     else:
-        dataset = LoadImages(source, img_size=imgsz, stride=stride, auto=pt, vid_stride=vid_stride)
-    vid_path, vid_writer = [None] * bs, [None] * bs
+        dataset = LoadImages(
+            source, img_size=imgsz, stride=stride, auto=pt, vid_stride=vid_stride, batch_size=batch_size
+        )
+        bs = batch_size
+    writer = ResultsWriter()  # txt, csv, JSON, image and video writes off the inference loop
 
     # Run inference
     model.warmup(imgsz=(1 if pt or model.triton else bs, 3, *imgsz))  # warmup
     seen, windows, dt = 0, [], (Profile(device=device), Profile(device=device), Profile(device=device))
-    for path, im, im0s, vid_cap, s in dataset:
-        with dt[0]:
-            im = torch.from_numpy(im).to(model.device)
-            im = im.half() if model.fp16 else im.float()  # uint8 to fp16/32
-            im /= 255  # 0 - 255 to 0.0 - 1.0
-            if len(im.shape) == 3:
-                im = im[None]  # expand for batch dim
-            if model.xml and im.shape[0] > 1:
-                ims = torch.chunk(im, im.shape[0], 0)
-
-        # Inference
-        with dt[1]:
-            visualize = increment_path(save_dir / Path(path).stem, mkdir=True) if visualize else False
-            if model.xml and im.shape[0] > 1:
-                pred = None
-                for image in ims:
-                    if pred is None:
-                        pred = model(image, augment=augment, visualize=visualize).unsqueeze(0)
-                    else:
-                        pred = torch.cat((pred, model(image, augment=augment, visualize=visualize).unsqueeze(0)), dim=0)
-                pred = [pred, None]
-            else:
-                pred = model(im, augment=augment, visualize=visualize)
-        # NMS
-        with dt[2]:
-            pred = non_max_suppression(pred, conf_thres, iou_thres, classes, agnostic_nms, max_det=max_det)
 
+    @smart_inference_mode()  # grad mode is per thread
+    def frames():
+        """Yields preprocessed (im, (path, im, im0s, vid_cap, s, frame, count, mode)) for each dataset frame."""
+        for path, im, im0s, vid_cap, s in dataset:
+            with dt[0]:
+                im = torch.from_numpy(im).to(model.device)  # uint8, normalized by the model backend
+                if len(im.shape) == 3:
+                    im = im[None]  # expand for batch dim
+            state = getattr(dataset, "frame", 0), getattr(dataset, "count", 0), dataset.mode  # advances while in flight
+            yield im, (path, im, im0s, vid_cap, s, *state)
+
+    @smart_inference_mode()  # grad mode is per thread
+    def infer(frames):
+        """Yields (pred, frame, inference time) in order, keeping OpenVINO requests in flight with --ov-async."""
+        if model.xml and ov_async:
+            results = model.forward_async((x, (len(im), f)) for im, f in frames for x in im.split(1))  # per image
+            while True:
+                with dt[1]:  # waiting on in-flight requests, overlapped with preprocessing of queued frames
+                    y = next(results, None)
+                    y = [y] + [next(results) for _ in range(y[1][0] - 1)] if y else []  # all images of a frame
+                if not y:
+                    return
+                yield model.cat_outputs([x for x, _ in y]), y[0][1][1], dt[1].dt
+        for im, f in frames:
+            with dt[1]:
+                visualize_dir = increment_path(save_dir / Path(f[0]).stem, mkdir=True) if visualize else False
+                if model.xml and im.shape[0] > 1:
+                    pred = model.cat_outputs([model(x, augment=augment, visualize=visualize_dir) for x in im.split(1)])
+                else:
+                    pred = model(im, augment=augment, visualize=visualize_dir)
+            yield pred, f, dt[1].dt
+
+    @smart_inference_mode()  # grad mode is per thread
+    def nms(results):
+        """Yields (det, frame, inference time) after NMS for each inference result."""
+        for pred, f, t in results:
+            with dt[2]:
+                pred = non_max_suppression(
+                    pred, conf_thres, iou_thres, classes, agnostic_nms, max_det=max_det, method=nms_method
+                )
+            yield pred, f, t
+
+    # Pipeline, with --pipeline decode and inference + NMS run on threads with bounded queues, this thread is the sink
+    stage = threaded_iterator if pipeline else iter
+    for pred, (path, im, im0s, vid_cap, s, frame, count, mode), t in stage(nms(infer(stage(frames())))):
         # Second-stage classifier (optional)
         # pred = utils.general.apply_classifier(pred, classifier_model, im, im0s)
 
-        # Define the path for the CSV file
-        csv_path = save_dir / "predictions.csv"
-
-        # Create or append to the CSV file
-        def write_to_csv(image_name, prediction, confidence):
-            """Writes prediction data for an image to a CSV file, appending if the file exists."""
-            data = {"Image Name": image_name, "Prediction": prediction, "Confidence": confidence}
-            with open(csv_path, mode="a", newline="") as f:
-                writer = csv.DictWriter(f, fieldnames=data.keys())
-                if not csv_path.is_file():
-                    writer.writeheader()
-                writer.writerow(data)
-
         # Process predictions
         for i, det in enumerate(pred):  # per image
             seen += 1
-            if webcam:  # batch_size >= 1
-                p, im0, frame = path[i], im0s[i].copy(), dataset.count
+            if isinstance(path, list):  # batch_size >= 1
+                p, im0, frame = path[i], im0s[i].copy(), count
                 s += f"{i}: "
             else:
-                p, im0, frame = path, im0s.copy(), getattr(dataset, "frame", 0)
+                p, im0 = path, im0s.copy()
 
             p = Path(p)  # to Path
             save_path = str(save_dir / p.name)  # im.jpg
-            txt_path = str(save_dir / "labels" / p.stem) + ("" if dataset.mode == "image" else f"_{frame}")  # im.txt
+            txt_path = str(save_dir / "labels" / p.stem) + ("" if mode == "image" else f"_{frame}")  # im.txt
             s += "%gx%g " % im.shape[2:]  # print string
             gn = torch.tensor(im0.shape)[[1, 0, 1, 0]]  # normalization gain whwh
             imc = im0.copy() if save_crop else im0  # for save_crop
             annotator = Annotator(im0, line_width=line_thickness, example=str(names))
+            lines, rows, boxes = [], [], []  # txt, csv and JSON results, handed to the writer once per image
             if len(det):
                 # Rescale boxes from img_size to im0 size
                 det[:, :4] = scale_boxes(im.shape[2:], det[:, :4], im0.shape).round()
@@ -207,20 +227,32 @@ def run(
                     confidence_str = f"{confidence:.2f}"
 
                     if save_csv:
-                        write_to_csv(p.name, label, confidence_str)
+                        rows.append({"Image Name": p.name, "Prediction": label, "Confidence": confidence_str})
 
                     if save_txt:  # Write to file
                         xywh = (xyxy2xywh(torch.tensor(xyxy).view(1, 4)) / gn).view(-1).tolist()  # normalized xywh
                         line = (cls, *xywh, conf) if save_conf else (cls, *xywh)  # label format
-                        with open(f"{txt_path}.txt", "a") as f:
-                            f.write(("%g " * len(line)).rstrip() % line + "\n")
+                        lines.append(("%g " * len(line)).rstrip() % line)
+
+                    if save_json:
+                        xyxy_list = [float(x) for x in xyxy]
+                        boxes.append({"class": c, "name": names[c], "confidence": confidence, "xyxy": xyxy_list})
 
                     if save_img or save_crop or view_img:  # Add bbox to image
                         c = int(cls)  # integer class
                         label = None if hide_labels else (names[c] if hide_conf else f"{names[c]} {conf:.2f}")
                         annotator.box_label(xyxy, label, color=colors(c, True))
                     if save_crop:
-                        save_one_box(xyxy, imc, file=save_dir / "crops" / names[c] / f"{p.stem}.jpg", BGR=True)
+                        crop = save_one_box(xyxy, imc, BGR=True, save=False)
+                        writer.image(save_dir / "crops" / names[c] / f"{p.stem}.jpg", crop, increment=True)
+
+            if lines:
+                writer.text(f"{txt_path}.txt", lines)
+            if rows:
+                writer.csv(save_dir / "predictions.csv", rows)
+            if save_json:
+                record = {"image": p.name, "frame": frame, "boxes": boxes}
+                writer.text(save_dir / "predictions.jsonl", [json.dumps(record)])
 
             # Stream results
             im0 = annotator.result()
@@ -232,27 +264,24 @@ def run(
                 cv2.imshow(str(p), im0)
                 cv2.waitKey(1)  # 1 millisecond
 
-            # Save results (image with detections)
+            # Save results (image with detections), encoded on the writer thread
             if save_img:
-                if dataset.mode == "image":
-                    cv2.imwrite(save_path, im0)
+                if mode == "image":
+                    writer.image(save_path, im0)
                 else:  # 'video' or 'stream'
-                    if vid_path[i] != save_path:  # new video
-                        vid_path[i] = save_path
-                        if isinstance(vid_writer[i], cv2.VideoWriter):
-                            vid_writer[i].release()  # release previous video writer
-                        if vid_cap:  # video
-                            fps = vid_cap.get(cv2.CAP_PROP_FPS)
-                            w = int(vid_cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-                            h = int(vid_cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-                        else:  # stream
-                            fps, w, h = 30, im0.shape[1], im0.shape[0]
-                        save_path = str(Path(save_path).with_suffix(".mp4"))  # force *.mp4 suffix on results videos
-                        vid_writer[i] = cv2.VideoWriter(save_path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (w, h))
-                    vid_writer[i].write(im0)
+                    if vid_cap:  # video
+                        fps = vid_cap.get(cv2.CAP_PROP_FPS)
+                        w = int(vid_cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+                        h = int(vid_cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+                    else:  # stream
+                        fps, w, h = 30, im0.shape[1], im0.shape[0]
+                    writer.video(i, save_path, im0, fps, w, h)
+            writer.frame()
 
         # Print time (inference-only)
-        LOGGER.info(f"{s}{'' if len(det) else '(no detections), '}{dt[1].dt * 1E3:.1f}ms")
+        LOGGER.info(f"{s}{'' if len(det) else '(no detections), '}{t * 1E3:.1f}ms")
+
+    writer.close()  # flush results before counting saved labels
 
     # Print results
     t = tuple(x.t / seen * 1e3 for x in dt)  # speeds per image
@@ -278,11 +307,13 @@ def parse_opt():
     parser.add_argument("--view-img", action="store_true", help="show results")
     parser.add_argument("--save-txt", action="store_true", help="save results to *.txt")
     parser.add_argument("--save-csv", action="store_true", help="save results in CSV format")
+    parser.add_argument("--save-json", action="store_true", help="save results in JSON-lines format")
     parser.add_argument("--save-conf", action="store_true", help="save confidences in --save-txt labels")
     parser.add_argument("--save-crop", action="store_true", help="save cropped prediction boxes")
     parser.add_argument("--nosave", action="store_true", help="do not save images/videos")
     parser.add_argument("--classes", nargs="+", type=int, help="filter by class: --classes 0, or --classes 0 2 3")
     parser.add_argument("--agnostic-nms", action="store_true", help="class-agnostic NMS")
+    parser.add_argument("--nms-method", default="hard", choices=NMS_METHODS, help="NMS method")
     parser.add_argument("--augment", action="store_true", help="augmented inference")
     parser.add_argument("--visualize", action="store_true", help="visualize features")
     parser.add_argument("--update", action="store_true", help="update all models")
@@ -295,6 +326,9 @@ def parse_opt():
     parser.add_argument("--half", action="store_true", help="use FP16 half-precision inference")
     parser.add_argument("--dnn", action="store_true", help="use OpenCV DNN for ONNX inference")
     parser.add_argument("--vid-stride", type=int, default=1, help="video frame-rate stride")
+    parser.add_argument("--batch-size", type=int, default=1, help="batch size for image files and directories")
+    parser.add_argument("--ov-async", action="store_true", help="keep several OpenVINO infer requests in flight")
+    parser.add_argument("--pipeline", action="store_true", help="overlap decode, inference and saving on threads")
     opt = parser.parse_args()
     opt.imgsz *= 2 if len(opt.imgsz) == 1 else 1  # expand
     print_args(vars(opt))
@@ -3,13 +3,18 @@
 
 import ast
 import contextlib
+import hashlib
 import json
 import math
+import os
 import platform
 import warnings
 import zipfile
-from collections import OrderedDict, namedtuple
+from collections import OrderedDict, deque, namedtuple
 from copy import copy
+from functools import cached_property
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
 from pathlib import Path
 from urllib.parse import urlparse
 
@@ -36,9 +41,12 @@ except (ImportError, AssertionError):
 from ultralytics.utils.plotting import Annotator, colors, save_one_box
 
 from utils import TryExcept
-from utils.dataloaders import exif_transpose, letterbox
+from utils.dataloaders import exif_transpose, letterbox, letterbox_batch
 from utils.general import (
     LOGGER,
+    NUM_THREADS,
+    ORT_CACHE_DIR,
+    OV_CACHE_DIR,
     ROOT,
     Profile,
     check_requirements,
@@ -490,8 +498,24 @@ class DetectMultiBackend(nn.Module):
             import onnxruntime
 
             providers = ["CUDAExecutionProvider", "CPUExecutionProvider"] if cuda else ["CPUExecutionProvider"]
-            session = onnxruntime.InferenceSession(w, providers=providers)
+            if ORT_CACHE_DIR:  # opt-in cache of optimized graphs keyed by source model, ONNX Runtime and provider
+                h = hashlib.sha256(Path(w).read_bytes()).hexdigest()[:16]  # source model hash
+                key = f"{h}-{onnxruntime.__version__}-{providers[0]}"
+                f = Path(ORT_CACHE_DIR) / f"{Path(w).stem}-{key}.onnx"
+                if not f.is_file():  # optimize at the portable EXTENDED level, ALL adds machine-specific layouts
+                    f.parent.mkdir(parents=True, exist_ok=True)
+                    tmp = f.with_suffix(f".{os.getpid()}.onnx")
+                    so = onnxruntime.SessionOptions()
+                    so.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED
+                    so.optimized_model_filepath = str(tmp)
+                    onnxruntime.InferenceSession(w, sess_options=so, providers=providers)
+                    os.replace(tmp, f)  # atomic, concurrent loads never read a partial graph
+                LOGGER.info(f"Using optimized ONNX Runtime graph {f}")
+                w = str(f)
+            session = onnxruntime.InferenceSession(w, providers=providers)  # remaining optimizations online
             output_names = [x.name for x in session.get_outputs()]
+            ort_cuda = session.get_providers()[0] == "CUDAExecutionProvider"  # bind buffers in device memory
+            ort_bindings = OrderedDict()  # IOBinding with preallocated input and output buffers per input shape, LRU
             meta = session.get_modelmeta().custom_metadata_map  # metadata
             if "stride" in meta:
                 stride, names = int(meta["stride"]), eval(meta["names"])
@@ -503,6 +527,8 @@ class DetectMultiBackend(nn.Module):
             core = Core()
             if not Path(w).is_file():  # if not *.xml
                 w = next(Path(w).glob("*.xml"))  # get *.xml file from *_openvino_model dir
+            if OV_CACHE_DIR:  # opt-in, reuse compiled blobs across loads
+                core.set_property({"CACHE_DIR": OV_CACHE_DIR})
             ov_model = core.read_model(model=w, weights=Path(w).with_suffix(".bin"))
             if ov_model.get_parameters()[0].get_layout().empty:
                 ov_model.get_parameters()[0].set_layout(Layout("NCHW"))
@@ -510,6 +536,7 @@ class DetectMultiBackend(nn.Module):
             if batch_dim.is_static:
                 batch_size = batch_dim.get_length()
             ov_compiled_model = core.compile_model(ov_model, device_name="AUTO")  # AUTO selects best available device
+            ov_queues, ov_results = {}, {}  # persistent async infer request pools by size, finished results by key
             stride, names = self._load_metadata(Path(w).with_suffix(".yaml"))  # load metadata
         elif engine:  # TensorRT
             LOGGER.info(f"Loading {w} for TensorRT inference...")
@@ -657,7 +684,11 @@ class DetectMultiBackend(nn.Module):
     def forward(self, im, augment=False, visualize=False):
         """Performs YOLOv5 inference on input images with options for augmentation and visualization."""
         b, ch, h, w = im.shape  # batch, channel, height, width
-        if self.fp16 and im.dtype != torch.float16:
+        iobinding = self.onnx and not self.dnn  # ONNX Runtime normalizes into its bound input buffer
+        if im.dtype == torch.uint8 and not iobinding:  # i.e. letterboxed frames
+            im = im.half() if self.fp16 else im.float()  # uint8 to fp16/32
+            im /= 255  # 0 - 255 to 0.0 - 1.0
+        if self.fp16 and im.dtype != torch.float16 and not iobinding:
             im = im.half()  # to FP16
         if self.nhwc:
             im = im.permute(0, 2, 3, 1)  # torch BCHW to numpy BHWC shape(1,320,192,3)
@@ -671,8 +702,14 @@ class DetectMultiBackend(nn.Module):
             self.net.setInput(im)
             y = self.net.forward()
         elif self.onnx:  # ONNX Runtime
-            im = im.cpu().numpy()  # torch to numpy
-            y = self.session.run(self.output_names, {self.session.get_inputs()[0].name: im})
+            binding, x, y = self.ort_binding(tuple(im.shape))
+            x.copy_(im)  # into bound input buffer, no allocation
+            if im.dtype == torch.uint8:
+                x /= 255  # 0 - 255 to 0.0 - 1.0
+            if self.ort_cuda:  # ORT reads the input buffer outside torch's stream
+                torch.cuda.current_stream(self.device).synchronize()
+            self.session.run_with_iobinding(binding)
+            y = [t.to(self.device, copy=True) for t in y]  # copy out of bound buffers, reused by the next call
         elif self.xml:  # OpenVINO
             im = im.cpu().numpy()  # FP32
             y = list(self.ov_compiled_model(im).values())
@@ -736,17 +773,90 @@ class DetectMultiBackend(nn.Module):
         else:
             return self.from_numpy(y)
 
+    def forward_async(self, items, jobs=0):
+        """
+        Yields (y, data) for each (im, data) in `items`, in order, from an OpenVINO pool of `jobs` async infer requests
+        (0 for the device's optimal number), so several images are in flight while `items` is still being produced.
+        """
+        from openvino.runtime import AsyncInferQueue
+
+        results = self.ov_results
+        if jobs not in self.ov_queues:  # created once, infer requests are reused across calls
+            queue = AsyncInferQueue(self.ov_compiled_model, jobs)
+            queue.set_callback(lambda request, k: results.update({k: [x.copy() for x in request.results.values()]}))
+            self.ov_queues[jobs] = queue
+        queue, pending, call = self.ov_queues[jobs], deque(), object()  # results keyed (call, i) per call
+
+        def done():
+            """Yields finished results at the head of the submission order."""
+            while pending and pending[0][0] in results:
+                k, data = pending.popleft()
+                y = results.pop(k)
+                yield (self.from_numpy(y[0]) if len(y) == 1 else [self.from_numpy(x) for x in y]), data
+
+        for i, (im, data) in enumerate(items):
+            if im.dtype == torch.uint8:
+                im = im.float() / 255  # 0 - 255 to 0.0 - 1.0
+            queue.start_async(im.cpu().numpy(), userdata=(call, i))  # blocks while all requests are busy
+            pending.append(((call, i), data))
+            yield from done()
+        queue.wait_all()
+        yield from done()
+
+    @staticmethod
+    def cat_outputs(y):
+        """Concatenates per-image outputs `y` along the batch dimension, for tensors or lists of output tensors."""
+        return [torch.cat(x) for x in zip(*y)] if isinstance(y[0], (list, tuple)) else torch.cat(y)
+
+    def ort_binding(self, shape, n=4):
+        """Returns an ONNX Runtime IOBinding with torch input and output buffers preallocated once per input `shape`,
+        keeping the `n` most recently used shapes.
+        """
+        if shape in self.ort_bindings:
+            self.ort_bindings.move_to_end(shape)
+        else:
+            dtypes = {"tensor(float)": (torch.float32, np.float32), "tensor(float16)": (torch.float16, np.float16)}
+            device = self.device if self.ort_cuda else torch.device("cpu")
+            device_type, device_id = ("cuda", device.index or 0) if self.ort_cuda else ("cpu", 0)
+            binding = self.session.io_binding()
+            input = self.session.get_inputs()[0]
+            x = torch.empty(shape, dtype=dtypes[input.type][0], device=device)
+            binding.bind_input(input.name, device_type, device_id, dtypes[input.type][1], shape, x.data_ptr())
+            for name in self.output_names:  # first run lets ORT allocate, to read dynamic output shapes
+                binding.bind_output(name, device_type, device_id)
+            self.session.run_with_iobinding(binding)
+            outputs = binding.get_outputs()
+            binding.clear_binding_outputs()
+            y = []
+            for name, output in zip(self.output_names, outputs):
+                t = torch.empty(output.shape(), dtype=dtypes[output.data_type()][0], device=device)
+                binding.bind_output(name, device_type, device_id, dtypes[output.data_type()][1], t.shape, t.data_ptr())
+                y.append(t)
+            self.ort_bindings[shape] = binding, x, y
+            while len(self.ort_bindings) > n:
+                self.ort_bindings.popitem(last=False)  # free least recently used buffers
+        return self.ort_bindings[shape]
+
     def from_numpy(self, x):
         """Converts a NumPy array to a torch tensor, maintaining device compatibility."""
         return torch.from_numpy(x).to(self.device) if isinstance(x, np.ndarray) else x
 
     def warmup(self, imgsz=(1, 3, 640, 640)):
-        """Performs a single inference warmup to initialize model weights, accepting an `imgsz` tuple for image size."""
+        """
+        Warms up the model at input shape `imgsz` (b,c,h,w) or a list of shapes, so the first request at every expected
+        shape does not pay cuDNN autotuning, TorchScript specialization or ONNX Runtime buffer allocation.
+
+        Shape lists also warm up TorchScript and ONNX Runtime on CPU.
+        """
+        shapes = [imgsz] if isinstance(imgsz[0], int) else imgsz
+        shapes = list(dict.fromkeys(tuple(int(i) for i in x) for x in shapes))  # unique, in order
         warmup_types = self.pt, self.jit, self.onnx, self.engine, self.saved_model, self.pb, self.triton
-        if any(warmup_types) and (self.device.type != "cpu" or self.triton):
-            im = torch.empty(*imgsz, dtype=torch.half if self.fp16 else torch.float, device=self.device)  # input
-            for _ in range(2 if self.jit else 1):  #
-                self.forward(im)  # warmup
+        cpu = len(shapes) > 1 and (self.jit or self.onnx)  # per-shape compilation and allocation on CPU too
+        if any(warmup_types) and (self.device.type != "cpu" or self.triton or cpu):
+            for shape in shapes:
+                im = torch.empty(*shape, dtype=torch.half if self.fp16 else torch.float, device=self.device)  # input
+                for _ in range(2 if self.jit else 1):  # TorchScript profiling executor specializes on 2nd run
+                    self.forward(im)  # warmup
 
     @staticmethod
     def _model_type(p="path/to/model.pt"):
@@ -785,7 +895,9 @@ class AutoShape(nn.Module):
     multi_label = False  # NMS multiple labels per box
     classes = None  # (optional list) filter by class, i.e. = [0, 15, 16] for COCO persons, cats and dogs
     max_det = 1000  # maximum number of detections per image
+    method = "hard"  # NMS method, hard, merge, soft or wbf
     amp = False  # Automatic Mixed Precision (AMP) inference
+    session = None  # pooled requests.Session shared by URI fetch threads, created on first use
 
     def __init__(self, model, verbose=True):
         """Initializes YOLOv5 model for inference, setting up attributes and preparing model for evaluation."""
@@ -816,6 +928,12 @@ class AutoShape(nn.Module):
                 m.anchor_grid = list(map(fn, m.anchor_grid))
         return self
 
+    def warmup(self, size=640, batch_sizes=(1,)):
+        """Warms up a DetectMultiBackend model at square inference `size` for each of `batch_sizes`."""
+        if self.dmb:
+            shape1 = [make_divisible(x, self.stride) for x in ((size, size) if isinstance(size, int) else size)]
+            self.model.warmup(imgsz=[(b, 3, *shape1) for b in batch_sizes])
+
     @smart_inference_mode()
     def forward(self, ims, size=640, augment=False, profile=False):
         """
@@ -845,31 +963,38 @@ class AutoShape(nn.Module):
             # Pre-process
             n, ims = (len(ims), list(ims)) if isinstance(ims, (list, tuple)) else (1, [ims])  # number, list of images
             shape0, shape1, files = [], [], []  # image and inference shapes, filenames
-            for i, im in enumerate(ims):
-                f = f"image{i}"  # filename
-                if isinstance(im, (str, Path)):  # filename or uri
-                    im, f = Image.open(requests.get(im, stream=True).raw if str(im).startswith("http") else im), im
-                    im = np.asarray(exif_transpose(im))
-                elif isinstance(im, Image.Image):  # PIL Image
-                    im, f = np.asarray(exif_transpose(im)), getattr(im, "filename", f) or f
+            if n > 1 and any(isinstance(im, (str, Path, Image.Image)) for im in ims):  # fetch and decode in parallel
+                with ThreadPool(min(NUM_THREADS, n)) as pool:
+                    results = pool.map(self._read, enumerate(ims))  # ordered
+            else:
+                results = map(self._read, enumerate(ims))
+            for i, (im, f) in enumerate(results):
                 files.append(Path(f).with_suffix(".jpg").name)
-                if im.shape[0] < 5:  # image in CHW
-                    im = im.transpose((1, 2, 0))  # reverse dataloader .transpose(2, 0, 1)
-                im = im[..., :3] if im.ndim == 3 else cv2.cvtColor(im, cv2.COLOR_GRAY2BGR)  # enforce 3ch input
                 s = im.shape[:2]  # HWC
                 shape0.append(s)  # image shape
                 g = max(size) / max(s)  # gain
                 shape1.append([int(y * g) for y in s])
-                ims[i] = im if im.data.contiguous else np.ascontiguousarray(im)  # update
+                ims[i] = im  # update
             shape1 = [make_divisible(x, self.stride) for x in np.array(shape1).max(0)]  # inf shape
-            x = [letterbox(im, shape1, auto=False)[0] for im in ims]  # pad
-            x = np.ascontiguousarray(np.array(x).transpose((0, 3, 1, 2)))  # stack and BHWC to BCHW
-            x = torch.from_numpy(x).to(p.device).type_as(p) / 255  # uint8 to fp16/32
+            if len(set(shape0)) == 1 and n > 1 and p.device.type == "cuda":  # same-shape batch, letterbox on GPU
+                x = torch.from_numpy(np.stack(ims)).to(p.device).permute(0, 3, 1, 2)  # BHWC to BCHW
+                x = letterbox_batch(x.type_as(p), shape1, auto=False)[0] / 255  # uint8 to fp16/32
+            else:
+                if len(set(shape0)) == 1:  # same-shape images, one cv2.resize for the batch
+                    x = letterbox_batch(np.stack(ims), shape1, auto=False)[0]
+                else:
+                    x = np.array([letterbox(im, shape1, auto=False)[0] for im in ims])  # pad
+                x = np.ascontiguousarray(x.transpose((0, 3, 1, 2)))  # BHWC to BCHW
+                x = torch.from_numpy(x).to(p.device).type_as(p) / 255  # uint8 to fp16/32
 
         with amp.autocast(autocast):
             # Inference
             with dt[1]:
-                y = self.model(x, augment=augment)  # forward
+                if self.dmb and self.model.xml and len(x) > 1:  # OpenVINO, one async infer request per image
+                    y = [y for y, _ in self.model.forward_async((xi, None) for xi in x.split(1))]
+                    y = self.model.cat_outputs(y)
+                else:
+                    y = self.model(x, augment=augment)  # forward
 
             # Post-process
             with dt[2]:
@@ -881,33 +1006,71 @@ class AutoShape(nn.Module):
                     self.agnostic,
                     self.multi_label,
                     max_det=self.max_det,
+                    method=self.method,
                 )  # NMS
                 for i in range(n):
                     scale_boxes(shape1, y[i][:, :4], shape0[i])
 
             return Detections(ims, y, files, dt, self.names, x.shape)
 
+    @classmethod
+    def _read(cls, args):
+        """Resolves (index, file/URI/PIL/numpy input) to a contiguous HWC 3-channel numpy image and filename."""
+        i, im = args
+        f = f"image{i}"  # filename
+        if isinstance(im, (str, Path)):  # filename or uri
+            if str(im).startswith("http"):
+                if cls.session is None:
+                    cls.session = requests.Session()
+                    cls.session.mount("http", requests.adapters.HTTPAdapter(pool_maxsize=NUM_THREADS))
+                im, f = Image.open(BytesIO(cls.session.get(im).content)), im  # read body, connection back to pool
+            else:
+                im, f = Image.open(im), im
+            im = np.asarray(exif_transpose(im))
+        elif isinstance(im, Image.Image):  # PIL Image
+            im, f = np.asarray(exif_transpose(im)), getattr(im, "filename", f) or f
+        if im.shape[0] < 5:  # image in CHW
+            im = im.transpose((1, 2, 0))  # reverse dataloader .transpose(2, 0, 1)
+        im = im[..., :3] if im.ndim == 3 else cv2.cvtColor(im, cv2.COLOR_GRAY2BGR)  # enforce 3ch input
+        return (im if im.data.contiguous else np.ascontiguousarray(im)), f
+
 
 class Detections:
     # YOLOv5 detections class for inference results
     def __init__(self, ims, pred, files, times=(0, 0, 0), names=None, shape=None):
         """Initializes the YOLOv5 Detections class with image info, predictions, filenames, timing and normalization."""
         super().__init__()
-        d = pred[0].device  # device
-        gn = [torch.tensor([*(im.shape[i] for i in [1, 0, 1, 0]), 1, 1], device=d) for im in ims]  # normalizations
         self.ims = ims  # list of images as numpy arrays
         self.pred = pred  # list of tensors pred[0] = (xyxy, conf, cls)
         self.names = names  # class names
         self.files = files  # image filenames
         self.times = times  # profiling times
-        self.xyxy = pred  # xyxy pixels
-        self.xywh = [xyxy2xywh(x) for x in pred]  # xywh pixels
-        self.xyxyn = [x / g for x, g in zip(self.xyxy, gn)]  # xyxy normalized
-        self.xywhn = [x / g for x, g in zip(self.xywh, gn)]  # xywh normalized
+        self.xyxy = pred  # xyxy pixels, other box formats are computed on first access
         self.n = len(self.pred)  # number of images (batch size)
         self.t = tuple(x.t / self.n * 1e3 for x in times)  # timestamps (ms)
         self.s = tuple(shape)  # inference BCHW shape
 
+    @cached_property
+    def gn(self):
+        """Returns (n,6) normalization gains [w, h, w, h, 1, 1] for all images, built as one tensor."""
+        device = self.pred[0].device if self.n else "cpu"
+        return torch.tensor([[*(im.shape[i] for i in [1, 0, 1, 0]), 1, 1] for im in self.ims], device=device)
+
+    @cached_property
+    def xywh(self):
+        """Returns xywh pixel detections per image, computed on first access."""
+        return [xyxy2xywh(x) for x in self.pred]
+
+    @cached_property
+    def xyxyn(self):
+        """Returns xyxy normalized detections per image, computed on first access."""
+        return [x / g for x, g in zip(self.xyxy, self.gn)]
+
+    @cached_property
+    def xywhn(self):
+        """Returns xywh normalized detections per image, computed on first access."""
+        return [x / g for x, g in zip(self.xywh, self.gn)]
+
     def _run(self, pprint=False, show=False, save=False, crop=False, render=False, labels=True, save_dir=Path("")):
         """Executes model predictions, displaying and/or saving outputs with optional crops and labels."""
         s, crops = "", []
@@ -1004,10 +1167,33 @@ class Detections:
         ca = "xmin", "ymin", "xmax", "ymax", "confidence", "class", "name"  # xyxy columns
         cb = "xcenter", "ycenter", "width", "height", "confidence", "class", "name"  # xywh columns
         for k, c in zip(["xyxy", "xyxyn", "xywh", "xywhn"], [ca, ca, cb, cb]):
-            a = [[x[:5] + [int(x[5]), self.names[int(x[5])]] for x in x.tolist()] for x in getattr(self, k)]  # update
-            setattr(new, k, [pd.DataFrame(x, columns=c) for x in a])
+            a = [x.cpu().numpy().astype(float) for x in getattr(self, k)]  # one device copy per image
+            setattr(new, k, [pd.DataFrame({**dict(zip(c, x[:, :5].T)), **self._classes(x)}, columns=c) for x in a])
         return new
 
+    def _classes(self, x):
+        """Returns 'class' and 'name' columns for (n,6) detections array `x`."""
+        c = x[:, 5].astype(int)
+        return {"class": c, "name": [self.names[i] for i in c.tolist()]}
+
+    def numpy(self, boxes="xyxy"):
+        """
+        Returns all detections as one NumPy structured array with an 'image' index column, in 'xyxy', 'xyxyn', 'xywh' or
+        'xywhn' box format.
+
+        Example: a = results.numpy(); a[a["image"] == 0]["confidence"]
+        """
+        c = ("xcenter", "ycenter", "width", "height") if boxes.startswith("xywh") else ("xmin", "ymin", "xmax", "ymax")
+        dtype = [("image", np.int32), *((k, np.float32) for k in (*c, "confidence")), ("class", np.int32)]
+        x = getattr(self, boxes)
+        n = [len(d) for d in x]  # detections per image
+        x = torch.cat(x).float().cpu().numpy() if sum(n) else np.zeros((0, 6), dtype=np.float32)  # one device copy
+        a = np.empty(len(x), dtype=dtype)
+        a["image"] = np.repeat(np.arange(self.n), n)
+        for j, k in enumerate((*c, "confidence", "class")):
+            a[k] = x[:, j]
+        return a
+
     def tolist(self):
         """
         Converts a Detections object into a list of individual detection results for iteration.
@@ -236,7 +236,6 @@ def run(
                 f"{weights} ({ncm} classes) trained on different --data than what you passed ({nc} "
                 f"classes). Pass correct combination of --weights and --data that are trained together."
             )
-        model.warmup(imgsz=(1 if pt else batch_size, 3, imgsz, imgsz))  # warmup
         pad, rect = (0.0, False) if task == "speed" else (0.5, pt)  # square inference for benchmarks
         task = task if task in ("train", "val", "test") else "val"  # path to train/val/test images
         dataloader = create_dataloader(
@@ -252,6 +251,12 @@ def run(
             overlap_mask=overlap,
             mask_downsample_ratio=mask_downsample_ratio,
         )[0]
+        dataset = dataloader.dataset
+        if rect:  # warmup every letterboxed batch shape, including a smaller last batch
+            model.warmup(imgsz=[(n, 3, *s) for n, s in zip(np.bincount(dataset.batch), dataset.batch_shapes)])
+        else:  # full batches and a smaller last batch, non-PyTorch backends build each batch shape
+            b = [batch_size, len(dataset) % batch_size or batch_size]
+            model.warmup(imgsz=[(1 if pt else n, 3, imgsz, imgsz) for n in b])  # warmup
 
     seen = 0
     confusion_matrix = ConfusionMatrix(nc=nc)
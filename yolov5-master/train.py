@@ -49,9 +49,10 @@ import val as validate  # for end-of-epoch mAP
 from models.experimental import attempt_load
 from models.yolo import Model
 from utils.autoanchor import check_anchors
+from utils.augmentations import BatchAugment
 from utils.autobatch import check_train_batch_size
 from utils.callbacks import Callbacks
-from utils.dataloaders import create_dataloader
+from utils.dataloaders import BatchPrefetcher, create_dataloader, create_stream_dataloader
 from utils.downloads import attempt_download, is_url
 from utils.general import (
     LOGGER,
@@ -252,27 +253,44 @@ def train(hyp, opt, device, callbacks):
         LOGGER.info("Using SyncBatchNorm()")
 
     # Trainloader
-    train_loader, dataset = create_dataloader(
-        train_path,
-        imgsz,
-        batch_size // WORLD_SIZE,
-        gs,
-        single_cls,
-        hyp=hyp,
-        augment=True,
-        cache=None if opt.cache == "val" else opt.cache,
-        rect=opt.rect,
-        rank=LOCAL_RANK,
-        workers=workers,
-        image_weights=opt.image_weights,
-        quad=opt.quad,
-        prefix=colorstr("train: "),
-        shuffle=True,
-        seed=opt.seed,
-    )
-    labels = np.concatenate(dataset.labels, 0)
-    mlc = int(labels[:, 0].max())  # max label class
-    assert mlc < nc, f"Label class {mlc} exceeds nc={nc} in {data}. Possible class labels are 0-{nc - 1}"
+    if opt.stream:  # tar shards, labels are only read while streaming
+        train_loader, dataset = create_stream_dataloader(
+            train_path,
+            imgsz,
+            batch_size // WORLD_SIZE,
+            gs,
+            single_cls,
+            hyp=hyp,
+            augment=True,
+            rank=LOCAL_RANK,
+            workers=workers,
+            prefix=colorstr("train: "),
+            seed=opt.seed,
+        )
+    else:
+        train_loader, dataset = create_dataloader(
+            train_path,
+            imgsz,
+            batch_size // WORLD_SIZE,
+            gs,
+            single_cls,
+            hyp=hyp,
+            augment=True,
+            cache=None if opt.cache == "val" else opt.cache,
+            rect=opt.rect,
+            rank=LOCAL_RANK,
+            workers=workers,
+            image_weights=opt.image_weights,
+            quad=opt.quad,
+            prefix=colorstr("train: "),
+            shuffle=True,
+            seed=opt.seed,
+            decoder=opt.decoder,
+            batch_augment=opt.batch_augment,
+        )
+        labels = np.concatenate(dataset.labels, 0)
+        mlc = int(labels[:, 0].max())  # max label class
+        assert mlc < nc, f"Label class {mlc} exceeds nc={nc} in {data}. Possible class labels are 0-{nc - 1}"
 
     # Process 0
     if RANK in {-1, 0}:
@@ -292,11 +310,12 @@ def train(hyp, opt, device, callbacks):
         )[0]
 
         if not resume:
-            if not opt.noautoanchor:
+            if not (opt.noautoanchor or opt.stream):  # AutoAnchor needs all labels up front
                 check_anchors(dataset, model=model, thr=hyp["anchor_t"], imgsz=imgsz)  # run AutoAnchor
             model.half().float()  # pre-reduce anchor precision
 
-        callbacks.run("on_pretrain_routine_end", labels, names)
+        if not opt.stream:
+            callbacks.run("on_pretrain_routine_end", labels, names)
 
     # DDP mode
     if cuda and RANK != -1:
@@ -310,7 +329,10 @@ def train(hyp, opt, device, callbacks):
     hyp["label_smoothing"] = opt.label_smoothing
     model.nc = nc  # attach number of classes to model
     model.hyp = hyp  # attach hyperparameters to model
-    model.class_weights = labels_to_class_weights(dataset.labels, nc).to(device) * nc  # attach class weights
+    if opt.stream:  # uniform, labels are not known up front
+        model.class_weights = torch.ones(nc, device=device)
+    else:
+        model.class_weights = labels_to_class_weights(dataset.labels, nc).to(device) * nc  # attach class weights
     model.names = names
 
     # Start training
@@ -325,6 +347,8 @@ def train(hyp, opt, device, callbacks):
     scaler = torch.cuda.amp.GradScaler(enabled=amp)
     stopper, stop = EarlyStopping(patience=opt.patience), False
     compute_loss = ComputeLoss(model)  # init loss class
+    batch_augment = BatchAugment(hyp, imgsz) if opt.batch_augment else None  # batched augmentation after collate
+    prefetcher = BatchPrefetcher(train_loader, device, transform=batch_augment)  # device transfer on a thread
     callbacks.run("on_train_start")
     LOGGER.info(
         f'Image sizes {imgsz} train, {imgsz} val\n'
@@ -347,9 +371,12 @@ def train(hyp, opt, device, callbacks):
         # dataset.mosaic_border = [b - imgsz, -b]  # height, width borders
 
         mloss = torch.zeros(3, device=device)  # mean losses
-        if RANK != -1:
+        if opt.stream:
+            dataset.set_epoch(epoch)  # reshuffle shard order
+        elif RANK != -1:
             train_loader.sampler.set_epoch(epoch)
-        pbar = enumerate(train_loader)
+        prefetcher.t, te = 0.0, time.time()  # data wait, epoch start
+        pbar = enumerate(prefetcher)
         LOGGER.info(("\n" + "%11s" * 7) % ("Epoch", "GPU_mem", "box_loss", "obj_loss", "cls_loss", "Instances", "Size"))
         if RANK in {-1, 0}:
             pbar = tqdm(pbar, total=nb, bar_format=TQDM_BAR_FORMAT)  # progress bar
@@ -357,7 +384,6 @@ def train(hyp, opt, device, callbacks):
         for i, (imgs, targets, paths, _) in pbar:  # batch -------------------------------------------------------------
             callbacks.run("on_train_batch_start")
             ni = i + nb * epoch  # number integrated batches (since train start)
-            imgs = imgs.to(device, non_blocking=True).float() / 255  # uint8 to float32, 0-255 to 0.0-1.0
 
             # Warmup
             if ni <= nw:
@@ -381,7 +407,7 @@ def train(hyp, opt, device, callbacks):
             # Forward
             with torch.cuda.amp.autocast(amp):
                 pred = model(imgs)  # forward
-                loss, loss_items = compute_loss(pred, targets.to(device))  # loss scaled by batch_size
+                loss, loss_items = compute_loss(pred, targets)  # loss scaled by batch_size
                 if RANK != -1:
                     loss *= WORLD_SIZE  # gradient averaged between devices in DDP mode
                 if opt.quad:
@@ -414,6 +440,11 @@ def train(hyp, opt, device, callbacks):
                     return
             # end batch ------------------------------------------------------------------------------------------------
 
+        # Data wait
+        te = time.time() - te  # epoch time
+        if RANK in {-1, 0} and prefetcher.t > 0.1 * te:
+            LOGGER.info(f"{prefetcher.t:.1f}s data wait ({prefetcher.t / te:.0%} of epoch), training is input-bound")
+
         # Scheduler
         lr = [x["lr"] for x in optimizer.param_groups]  # for loggers
         scheduler.step()
@@ -533,7 +564,10 @@ def parse_opt(known=False):
     )
     parser.add_argument("--resume_evolve", type=str, default=None, help="resume evolve from last generation")
     parser.add_argument("--bucket", type=str, default="", help="gsutil bucket")
-    parser.add_argument("--cache", type=str, nargs="?", const="ram", help="image --cache ram/disk")
+    parser.add_argument("--cache", type=str, nargs="?", const="ram", help="image --cache ram/disk/shard")
+    parser.add_argument("--batch-augment", action="store_true", help="augment whole batches on device after collate")
+    parser.add_argument("--stream", action="store_true", help="stream train tar shards, see make_tar_shards()")
+    parser.add_argument("--decoder", type=str, choices=["cv2", "reduced", "pil"], default="cv2", help="image decoder")
     parser.add_argument("--image-weights", action="store_true", help="use weighted image selection for training")
     parser.add_argument("--device", default="", help="cuda device, i.e. 0 or 0,1,2,3 or cpu")
     parser.add_argument("--multi-scale", action="store_true", help="vary img-size +/- 50%%")
@@ -603,6 +637,12 @@ def main(opt, callbacks=Callbacks()):
         if opt.name == "cfg":
             opt.name = Path(opt.cfg).stem  # use model.yaml as name
         opt.save_dir = str(increment_path(Path(opt.project) / opt.name, exist_ok=opt.exist_ok))
+    assert not (opt.batch_augment and opt.rect), "--batch-augment requires square batches, not compatible with --rect"
+    if opt.stream:
+        msg = "is not compatible with --stream, which reads images sequentially from tar shards"
+        for k in "rect", "image_weights", "quad", "batch_augment":
+            assert not getattr(opt, k), f"--{k.replace('_', '-')} {msg}"
+        assert opt.cache in (None, "val"), f"--cache {opt.cache} {msg}"
 
     # DDP mode
     device = select_device(opt.device, batch_size=opt.batch_size)
@@ -3,6 +3,7 @@
 
 import contextlib
 import platform
+import queue
 import threading
 
 
@@ -41,6 +42,43 @@ def threaded(func):
     return wrapper
 
 
+def threaded_iterator(iterable, maxsize=4):
+    """Iterates `iterable` on a daemon thread through a bounded queue of `maxsize`, re-raising its exceptions in order.
+
+    The thread stops once the generator is closed or garbage collected, e.g. after the consumer breaks out early.
+
+    Example: for x in threaded_iterator(decode(frames)):
+    """
+    q, end, stop = queue.Queue(maxsize=maxsize), object(), threading.Event()
+
+    def put(x):
+        """Puts `x` on the queue unless `stop` is set first, returns False if stopped."""
+        while not stop.is_set():
+            with contextlib.suppress(queue.Full):
+                q.put(x, timeout=0.1)
+                return True
+        return False
+
+    def run():
+        """Fills the queue from `iterable` until it ends or `stop` is set, then puts the end marker or exception."""
+        try:
+            for x in iterable:
+                if not put(x):
+                    return
+            put(end)
+        except Exception as e:
+            put(e)
+
+    threading.Thread(target=run, daemon=True).start()
+    try:
+        while (x := q.get()) is not end:
+            if isinstance(x, Exception):
+                raise x
+            yield x
+    finally:
+        stop.set()
+
+
 def join_threads(verbose=False):
     """
     Joins all daemon threads, optionally printing their names if verbose is True.
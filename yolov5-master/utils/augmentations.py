@@ -7,10 +7,11 @@ import random
 import cv2
 import numpy as np
 import torch
+import torch.nn.functional as F
 import torchvision.transforms as T
 import torchvision.transforms.functional as TF
 
-from utils.general import LOGGER, check_version, colorstr, resample_segments, segment2box, xywhn2xyxy
+from utils.general import LOGGER, check_version, colorstr, resample_segments, segment2box, xywhn2xyxy, xyxy2xywhn
 from utils.metrics import bbox_ioa
 
 IMAGENET_MEAN = 0.485, 0.456, 0.406  # RGB mean
@@ -118,9 +119,8 @@ def replicate(im, labels):
     return im, labels
 
 
-def letterbox(im, new_shape=(640, 640), color=(114, 114, 114), auto=True, scaleFill=False, scaleup=True, stride=32):
-    """Resizes and pads image to new_shape with stride-multiple constraints, returns resized image, ratio, padding."""
-    shape = im.shape[:2]  # current shape [height, width]
+def letterbox_params(shape, new_shape=(640, 640), auto=True, scaleFill=False, scaleup=True, stride=32):
+    """Returns the letterbox() ratio, resized (w, h) and (dw, dh) padding for an image of `shape` (h, w)."""
     if isinstance(new_shape, int):
         new_shape = (new_shape, new_shape)
 
@@ -142,7 +142,13 @@ def letterbox(im, new_shape=(640, 640), color=(114, 114, 114), auto=True, scaleF
 
     dw /= 2  # divide padding into 2 sides
     dh /= 2
+    return ratio, new_unpad, (dw, dh)
+
 
+def letterbox(im, new_shape=(640, 640), color=(114, 114, 114), auto=True, scaleFill=False, scaleup=True, stride=32):
+    """Resizes and pads image to new_shape with stride-multiple constraints, returns resized image, ratio, padding."""
+    shape = im.shape[:2]  # current shape [height, width]
+    ratio, new_unpad, (dw, dh) = letterbox_params(shape, new_shape, auto, scaleFill, scaleup, stride)
     if shape[::-1] != new_unpad:  # resize
         im = cv2.resize(im, new_unpad, interpolation=cv2.INTER_LINEAR)
     top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
@@ -151,6 +157,40 @@ def letterbox(im, new_shape=(640, 640), color=(114, 114, 114), auto=True, scaleF
     return im, ratio, (dw, dh)
 
 
+def letterbox_batch(
+    ims, new_shape=(640, 640), color=(114, 114, 114), auto=True, scaleFill=False, scaleup=True, stride=32
+):
+    """
+    Letterboxes a batch of same-shape images in one call, returning the batch, ratio and padding as letterbox().
+
+    ims is a (N,H,W,C) np.ndarray, resized by one cv2.resize over images stacked along channels, or a (N,C,H,W)
+    torch.Tensor resized with F.interpolate on its own device. The output dtype matches the input.
+    """
+    tensor = isinstance(ims, torch.Tensor)
+    n, h, w, c = (ims.shape[0], *ims.shape[2:], ims.shape[1]) if tensor else ims.shape
+    ratio, (nw, nh), (dw, dh) = letterbox_params((h, w), new_shape, auto, scaleFill, scaleup, stride)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    if tensor:
+        x = ims if ims.is_floating_point() else ims.float()  # resize floating inputs in their own dtype, i.e. fp16
+        if (w, h) != (nw, nh):  # resize
+            x = F.interpolate(x, size=(nh, nw), mode="bilinear", align_corners=False)
+        out = torch.tensor(color[:c], dtype=x.dtype, device=x.device).view(1, c, 1, 1)
+        out = out.repeat(n, 1, nh + top + bottom, nw + left + right)
+        out[..., top : top + nh, left : left + nw] = x
+        out = out if ims.is_floating_point() else out.round_().to(ims.dtype)
+    else:
+        if (w, h) != (nw, nh):  # resize
+            x = ims.transpose(1, 2, 0, 3).reshape(h, w, n * c)  # images stacked along channels
+            k = 510 // c * c  # cv2 supports up to 512 channels
+            x = [cv2.resize(np.ascontiguousarray(x[..., i : i + k]), (nw, nh)) for i in range(0, n * c, k)]  # linear
+            x = np.concatenate([y.reshape(nh, nw, -1) for y in x], 2)
+            ims = x.reshape(nh, nw, n, c).transpose(2, 0, 1, 3)
+        out = np.full((n, nh + top + bottom, nw + left + right, c), color[:c], dtype=ims.dtype)
+        out[:, top : top + nh, left : left + nw] = ims
+    return out, ratio, (dw, dh)
+
+
 def random_perspective(
     im, targets=(), segments=(), degrees=10, translate=0.1, scale=0.1, shear=10, perspective=0.0, border=(0, 0)
 ):
@@ -310,6 +350,167 @@ def mixup(im, labels, im2, labels2):
     return im, labels
 
 
+def rgb_to_hsv(x, eps=1e-8):
+    """Converts a BCHW RGB tensor in [0, 1] to HSV with all channels in [0, 1]."""
+    r, g, b = x.unbind(1)
+    v, mn = x.max(1)[0], x.min(1)[0]
+    c = v - mn  # chroma
+    h = torch.where(v == g, (b - r) / (c + eps) + 2, (r - g) / (c + eps) + 4)
+    h = torch.where(v == r, ((g - b) / (c + eps)) % 6, h)
+    h = torch.where(c > 0, h / 6, torch.zeros_like(h))
+    return torch.stack((h, c / (v + eps), v), 1)
+
+
+def hsv_to_rgb(x):
+    """Converts a BCHW HSV tensor with all channels in [0, 1] to RGB in [0, 1]."""
+    h, s, v = x[:, 0:1], x[:, 1:2], x[:, 2:3]
+    k = (torch.tensor([5.0, 3.0, 1.0], device=x.device).view(1, 3, 1, 1) + h * 6) % 6
+    return v - v * s * torch.clamp(torch.minimum(k, 4 - k), 0, 1)
+
+
+class BatchAugment:
+    """
+    YOLOv5 batched augmentation applied after collate_fn, i.e. imgs, targets = BatchAugment(hyp, 640)(imgs, targets).
+
+    Applies mosaic, random_perspective, mixup, augment_hsv and flips to a whole (B, 3, s, s) RGB uint8 batch on its own
+    device, with targets (n, 6) as image index, class, xywhn. Mosaic tiles are other letterboxed images from the same
+    batch and boxes are warped without segments.
+    """
+
+    def __init__(self, hyp, img_size=640):
+        """Initializes batched augmentation with hyperparameters `hyp` for square `img_size` batches."""
+        self.hyp = hyp
+        self.s = img_size
+
+    def __call__(self, imgs, targets):
+        """Augments a collated uint8 image batch and its targets, returning them on the batch device."""
+        hyp, s = self.hyp, self.s
+        imgs, targets = imgs.float(), targets.to(imgs.device).float()
+        mosaic = torch.rand(len(imgs), device=imgs.device) < hyp["mosaic"]
+        imgs, targets = self.mosaic_perspective(imgs, targets, mosaic)
+        imgs, targets = self.mixup(imgs, targets, p=hyp["mixup"])
+        if len(targets):
+            targets[:, 2:] = xyxy2xywhn(targets[:, 2:], w=s, h=s, clip=True, eps=1e-3)
+        imgs = self.augment_hsv(imgs, hgain=hyp["hsv_h"], sgain=hyp["hsv_s"], vgain=hyp["hsv_v"])
+        imgs, targets = self.flip(imgs, targets, hyp["flipud"], dim=2)
+        imgs, targets = self.flip(imgs, targets, hyp["fliplr"], dim=3)
+        return imgs.round_().clamp_(0, 255).byte(), targets
+
+    def affine(self, n, size, device):
+        """Returns (n, 3, 3) random_perspective() matrices from canvas sizes `size` to s x s, and their scales."""
+        hyp, s = self.hyp, self.s
+
+        def uniform(a, b):
+            return torch.rand(n, device=device) * (b - a) + a
+
+        C, P, R, S, T = (torch.eye(3, device=device).repeat(n, 1, 1) for _ in range(5))
+        C[:, 0, 2] = C[:, 1, 2] = -size / 2  # center
+        P[:, 2, 0] = uniform(-hyp["perspective"], hyp["perspective"])  # x perspective (about y)
+        P[:, 2, 1] = uniform(-hyp["perspective"], hyp["perspective"])  # y perspective (about x)
+        a = uniform(-hyp["degrees"], hyp["degrees"]) * math.pi / 180  # rotation, counter-clockwise as cv2
+        sc = uniform(1 - hyp["scale"], 1 + hyp["scale"])  # scale
+        R[:, 0, 0], R[:, 0, 1], R[:, 1, 0], R[:, 1, 1] = sc * a.cos(), sc * a.sin(), -sc * a.sin(), sc * a.cos()
+        S[:, 0, 1] = (uniform(-hyp["shear"], hyp["shear"]) * math.pi / 180).tan()  # x shear
+        S[:, 1, 0] = (uniform(-hyp["shear"], hyp["shear"]) * math.pi / 180).tan()  # y shear
+        T[:, 0, 2] = uniform(0.5 - hyp["translate"], 0.5 + hyp["translate"]) * s  # x translation
+        T[:, 1, 2] = uniform(0.5 - hyp["translate"], 0.5 + hyp["translate"]) * s  # y translation
+        return T @ S @ R @ P @ C, sc  # order of operations (right to left) is IMPORTANT
+
+    def mosaic_perspective(self, imgs, targets, mosaic):
+        """Builds 4-image mosaics for samples where `mosaic` is True and warps all samples with one grid_sample per
+        tile, as load_mosaic() + random_perspective(border=mosaic_border) or letterbox + random_perspective().
+        """
+        n, s, device = len(imgs), self.s, imgs.device
+        src = torch.cat((torch.arange(n, device=device)[:, None], torch.randint(0, n, (n, 3), device=device)), 1)
+        src = torch.where(mosaic[:, None], src.gather(1, torch.rand(n, 4, device=device).argsort(1)), src)  # shuffle
+        on = torch.ones(n, 4, dtype=torch.bool, device=device)
+        on[:, 1:] = mosaic[:, None]  # non-mosaic samples use tile 0 only
+        size = s * (1.0 + mosaic.float())  # canvas size, 2s mosaic or s letterbox
+        xc, yc = (s + mosaic * (torch.rand(n, device=device) - 0.5) * s for _ in range(2))  # mosaic center x, y
+        ox = torch.stack((xc - s, xc, xc - s, xc), 1)  # tile offsets in canvas
+        oy = torch.stack((yc - s, yc - s, yc, yc), 1)
+        M, sc = self.affine(n, size, device)
+
+        # Images, output pixel -> canvas -> tile coordinates
+        y, x = torch.arange(s, device=device), torch.arange(s, device=device)
+        torch_1_10 = check_version(torch.__version__, "1.10.0")
+        y, x = torch.meshgrid(y, x, indexing="ij") if torch_1_10 else torch.meshgrid(y, x)  # torch>=0.7 compatibility
+        p = torch.stack((x.flatten(), y.flatten(), torch.ones(s * s, device=device)), 0).float()  # (3, s*s)
+        c = torch.linalg.inv(M) @ p  # (n, 3, s*s)
+        cx, cy = (c[:, :2] / c[:, 2:3]).view(n, 2, s, s).unbind(1)
+        canvas = (cx >= -0.5) & (cx < size.view(-1, 1, 1) - 0.5) & (cy >= -0.5) & (cy < size.view(-1, 1, 1) - 0.5)
+        out, filled = torch.zeros_like(imgs), torch.zeros_like(cx, dtype=torch.bool)
+        for t in range(4):
+            tx, ty = cx - ox[:, t].view(-1, 1, 1), cy - oy[:, t].view(-1, 1, 1)
+            m = canvas & on[:, t].view(-1, 1, 1) & (tx >= -0.5) & (tx < s - 0.5) & (ty >= -0.5) & (ty < s - 0.5)
+            grid = torch.stack(((2 * tx + 1) / s - 1, (2 * ty + 1) / s - 1), -1)  # align_corners=False
+            im = F.grid_sample(imgs[src[:, t]], grid, mode="bilinear", padding_mode="border", align_corners=False)
+            out += im * m[:, None]
+            filled |= m
+        out += (~filled[:, None]) * 114.0  # borderValue
+
+        # Boxes
+        labels = []
+        for t in range(4):
+            b, k = ((targets[:, 0].long()[None] == src[:, t, None]) & on[:, t, None]).nonzero().T  # output, target
+            if not len(k):
+                continue
+            box = xywhn2xyxy(targets[k, 2:], s, s, ox[b, t], oy[b, t])  # canvas pixel xyxy
+            box = torch.minimum(box.clamp(min=0), size[b, None])  # clip to canvas
+            xy = torch.ones(len(b), 4, 3, device=device)
+            xy[..., :2] = box[:, [0, 1, 2, 3, 0, 3, 2, 1]].view(-1, 4, 2)  # x1y1, x2y2, x1y2, x2y1
+            xy = xy @ M[b].transpose(1, 2)  # transform
+            xy = xy[..., :2] / xy[..., 2:3]  # perspective rescale or affine
+            new = torch.cat((xy.min(1)[0], xy.max(1)[0]), 1).clamp(0, s)  # xyxy, clip
+            w1, h1 = (box[:, 2] - box[:, 0]) * sc[b], (box[:, 3] - box[:, 1]) * sc[b]
+            w2, h2 = new[:, 2] - new[:, 0], new[:, 3] - new[:, 1]
+            ar = torch.maximum(w2 / (h2 + 1e-16), h2 / (w2 + 1e-16))  # aspect ratio
+            i = (w2 > 2) & (h2 > 2) & (w2 * h2 / (w1 * h1 + 1e-16) > 0.1) & (ar < 100)  # box_candidates()
+            labels.append(torch.cat((b[i, None].float(), targets[k[i], 1:2], new[i]), 1))
+        return out, torch.cat(labels, 0) if labels else targets.new_zeros((0, 6))
+
+    def mixup(self, imgs, targets, p=0.0):
+        """Blends samples with probability `p` with the next sample in the batch, merging their xyxy targets."""
+        n = len(imgs)
+        i = (torch.rand(n, device=imgs.device) < p).nonzero()[:, 0]
+        if not len(i):
+            return imgs, targets
+        j = (i + 1) % n  # partner samples
+        r = torch.distributions.Beta(32.0, 32.0).sample((len(i),)).to(imgs.device).view(-1, 1, 1, 1)  # mixup ratio
+        imgs = imgs.clone()
+        imgs[i] = imgs[i] * r + imgs[j] * (1 - r)
+        t = targets[(targets[:, 0:1] == j.view(1, -1).float()).any(1)]  # partner targets
+        t[:, 0] = (t[:, 0] - 1) % n  # reassign to the blended sample
+        return imgs, torch.cat((targets, t), 0)
+
+    @staticmethod
+    def augment_hsv(imgs, hgain=0.5, sgain=0.5, vgain=0.5):
+        """Applies augment_hsv() to RGB 0-255 float images with per-sample random gains."""
+        if not (hgain or sgain or vgain):
+            return imgs
+        n = len(imgs)
+        gain = torch.tensor([hgain, sgain, vgain], device=imgs.device)
+        r = (torch.rand(n, 3, device=imgs.device) * 2 - 1) * gain + 1  # random gains
+        hsv = rgb_to_hsv(imgs / 255)
+        h = (hsv[:, 0] * r[:, 0, None, None]) % 1
+        sat = (hsv[:, 1] * r[:, 1, None, None]).clamp(0, 1)
+        v = (hsv[:, 2] * r[:, 2, None, None]).clamp(0, 1)
+        return hsv_to_rgb(torch.stack((h, sat, v), 1)) * 255
+
+    @staticmethod
+    def flip(imgs, targets, p, dim=3):
+        """Flips samples with probability `p` up-down (dim=2) or left-right (dim=3), updating xywhn targets."""
+        f = torch.rand(len(imgs), device=imgs.device) < p
+        if not f.any():
+            return imgs, targets
+        imgs = torch.where(f.view(-1, 1, 1, 1), imgs.flip(dim), imgs)
+        if len(targets):
+            k = f[targets[:, 0].long()]
+            c = 2 if dim == 3 else 3  # x or y center column
+            targets[k, c] = 1 - targets[k, c]
+        return imgs, targets
+
+
 def box_candidates(box1, box2, wh_thr=2, ar_thr=100, area_thr=0.1, eps=1e-16):
     """
     Filters bounding box candidates by minimum width-height threshold `wh_thr` (pixels), aspect ratio threshold
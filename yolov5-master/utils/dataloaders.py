@@ -1,19 +1,25 @@
 # YOLOv5 🚀 by Ultralytics, AGPL-3.0 license
 """Dataloaders and dataset utils."""
 
+import atexit
 import contextlib
 import glob
 import hashlib
 import json
 import math
 import os
+import pickle
+import queue
 import random
+import re
 import shutil
+import tarfile
 import time
-from itertools import repeat
+from itertools import chain, islice
+from multiprocessing import resource_tracker, shared_memory
 from multiprocessing.pool import Pool, ThreadPool
 from pathlib import Path
-from threading import Thread
+from threading import Event, Thread
 from urllib.parse import urlparse
 
 import numpy as np
@@ -23,7 +29,7 @@ import torch.nn.functional as F
 import torchvision
 import yaml
 from PIL import ExifTags, Image, ImageOps
-from torch.utils.data import DataLoader, Dataset, dataloader, distributed
+from torch.utils.data import DataLoader, Dataset, IterableDataset, dataloader, distributed, get_worker_info
 from tqdm import tqdm
 
 from utils.augmentations import (
@@ -33,6 +39,7 @@ from utils.augmentations import (
     classify_transforms,
     copy_paste,
     letterbox,
+    letterbox_batch,
     mixup,
     random_perspective,
 )
@@ -65,6 +72,8 @@ LOCAL_RANK = int(os.getenv("LOCAL_RANK", -1))  # https://pytorch.org/docs/stable
 RANK = int(os.getenv("RANK", -1))
 WORLD_SIZE = int(os.getenv("WORLD_SIZE", 1))
 PIN_MEMORY = str(os.getenv("PIN_MEMORY", True)).lower() == "true"  # global pin_memory for dataloaders
+SHARD_BYTES = int(os.getenv("SHARD_BYTES", 4 << 30))  # max bytes per --cache shard file
+SHM_HEADER = 64  # bytes before images in the shared-memory RAM cache, byte 0 is set to 1 once the cache is complete
 
 # Get orientation exif tag
 for orientation in ExifTags.TAGS.keys():
@@ -80,6 +89,41 @@ def get_hash(paths):
     return h.hexdigest()  # return hash
 
 
+def file_stat(path):
+    """Returns a (size, mtime_ns) tuple for `path`, or (0, 0) if it does not exist."""
+    try:
+        st = os.stat(path)
+        return st.st_size, st.st_mtime_ns
+    except OSError:
+        return 0, 0
+
+
+def attach_shared_memory(name):
+    """Attaches to an existing SharedMemory block without registering it for cleanup by this process."""
+    shm = shared_memory.SharedMemory(name)
+    with contextlib.suppress(Exception):  # the creating process unlinks, https://bugs.python.org/issue38119
+        resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def load_scan_journal(path):
+    """Loads {im_file: ((labels, shape, segments), msg, stats)} checkpointed by an interrupted cache_labels() scan."""
+    done = {}
+    with contextlib.suppress(OSError, EOFError, pickle.UnpicklingError):  # missing, or truncated by the interruption
+        with open(path, "rb") as f:
+            while True:
+                done.update(pickle.load(f))
+    return done
+
+
+def load_error_index(path):
+    """Loads the {im_file: {'status': 'corrupt' | 'repaired', 'stats', 'msg'}} index of bad files next to a cache."""
+    try:
+        return {k: v for k, v in json.loads(Path(path).read_text()).items() if v["status"] in {"corrupt", "repaired"}}
+    except Exception:
+        return {}
+
+
 def exif_size(img):
     """Returns corrected PIL image size (width, height) considering EXIF orientation."""
     s = img.size  # (width, height)
@@ -117,6 +161,43 @@ def exif_transpose(image):
     return image
 
 
+def imread_cv2(path, img_size=None, hw0=None):
+    """Decodes a BGR image at full resolution with OpenCV, returning (im, original hw)."""
+    im = cv2.imread(path)  # BGR
+    assert im is not None, f"Image Not Found {path}"
+    return im, im.shape[:2]
+
+
+def imread_reduced(path, img_size=None, hw0=None):
+    """Decodes a BGR JPEG with OpenCV at the smallest DCT scale 1/2, 1/4 or 1/8 that stays >= `img_size`, given the
+    original (EXIF-corrected) `hw0`; other formats decode at full resolution. Returns (im, original hw).
+    """
+    f = 1  # scale denominator
+    if img_size and hw0 is not None and path.rsplit(".", 1)[-1].lower() in ("jpg", "jpeg"):
+        while f < 8 and max(hw0) / (f * 2) >= img_size:
+            f *= 2
+    flags = {1: cv2.IMREAD_COLOR, 2: cv2.IMREAD_REDUCED_COLOR_2, 4: cv2.IMREAD_REDUCED_COLOR_4}
+    im = cv2.imread(path, flags.get(f, cv2.IMREAD_REDUCED_COLOR_8))  # BGR
+    assert im is not None, f"Image Not Found {path}"
+    return im, (tuple(int(x) for x in hw0) if f > 1 else im.shape[:2])
+
+
+def imread_pil(path, img_size=None, hw0=None):
+    """Decodes a BGR image with PIL, using JPEG draft mode to decode at a reduced scale still >= `img_size`. Returns
+    (im, original hw).
+    """
+    im = Image.open(path)
+    w0, h0 = exif_size(im)
+    r = img_size / max(im.size) if img_size else 1  # ratio
+    if r < 1:  # draft() only reduces JPEG decode size, a no-op for other formats
+        im.draft("RGB", (math.ceil(im.width * r), math.ceil(im.height * r)))
+    im = np.asarray(exif_transpose(im).convert("RGB"))[..., ::-1]  # RGB to BGR
+    return np.ascontiguousarray(im), (h0, w0)
+
+
+IMAGE_DECODERS = {"cv2": imread_cv2, "reduced": imread_reduced, "pil": imread_pil}  # i.e. LoadImagesAndLabels(decoder=)
+
+
 def seed_worker(worker_id):
     """
     Sets the seed for a dataloader worker to ensure reproducibility, based on PyTorch's randomness notes.
@@ -173,6 +254,8 @@ def create_dataloader(
     prefix="",
     shuffle=False,
     seed=0,
+    decoder="cv2",
+    batch_augment=False,
 ):
     if rect and shuffle:
         LOGGER.warning("WARNING ⚠️ --rect is incompatible with DataLoader shuffle, setting shuffle=False")
@@ -192,6 +275,8 @@ def create_dataloader(
             image_weights=image_weights,
             prefix=prefix,
             rank=rank,
+            decoder=decoder,
+            batch_augment=batch_augment,
         )
 
     batch_size = min(batch_size, len(dataset))
@@ -214,6 +299,56 @@ def create_dataloader(
     ), dataset
 
 
+def create_stream_dataloader(
+    path,
+    imgsz,
+    batch_size,
+    stride,
+    single_cls=False,
+    hyp=None,
+    augment=False,
+    rank=-1,
+    workers=8,
+    buffer=1000,
+    n=None,
+    prefix="",
+    seed=0,
+):
+    """Creates a DataLoader over LoadImagesAndLabelsStream tar shards, with the create_dataloader() batch contract;
+    call dataset.set_epoch(epoch) before each epoch to reshuffle shard order.
+    """
+    dataset = LoadImagesAndLabelsStream(
+        path,
+        imgsz,
+        augment=augment,
+        hyp=hyp,
+        single_cls=single_cls,
+        stride=int(stride),
+        buffer=buffer,
+        n=n,
+        prefix=prefix,
+        rank=rank,
+        seed=seed,
+    )
+    nd = torch.cuda.device_count()  # number of CUDA devices
+    nw = min([os.cpu_count() // max(nd, 1), batch_size if batch_size > 1 else 0, workers])  # number of workers
+    ns = len(dataset.shards) // (1 if rank == -1 else WORLD_SIZE)  # shards per rank
+    if nw > ns:
+        LOGGER.warning(f"{prefix}WARNING ⚠️ {ns} shards per rank < {nw} workers, reducing workers to {ns}")
+        nw = ns
+    generator = torch.Generator()
+    generator.manual_seed(6148914691236517205 + seed + RANK)
+    return DataLoader(  # not InfiniteDataLoader, workers are re-created each epoch to pick up set_epoch()
+        dataset,
+        batch_size=batch_size,
+        num_workers=nw,
+        pin_memory=PIN_MEMORY,
+        collate_fn=LoadImagesAndLabels.collate_fn,
+        worker_init_fn=seed_worker,
+        generator=generator,
+    ), dataset
+
+
 class InfiniteDataLoader(dataloader.DataLoader):
     """
     Dataloader that reuses workers.
@@ -257,6 +392,92 @@ class _RepeatSampler:
             yield from iter(self.sampler)
 
 
+class BatchPrefetcher:
+    """
+    Prepares the next `n` batches of a YOLOv5 dataloader on a background thread.
+
+    Preparation moves images and targets to `device` (on a side CUDA stream), applies optional `transform(imgs,
+    targets)` to the uint8 images and normalizes them to float 0.0-1.0. `t` accumulates the seconds the consuming loop
+    waited for data, so `t / epoch time` shows whether a run is input-bound.
+
+    Usage
+        for imgs, targets, paths, shapes in BatchPrefetcher(train_loader, device):
+    """
+
+    def __init__(self, loader, device, n=2, half=False, transform=None):
+        """Initializes a prefetcher over `loader` keeping `n` prepared batches queued on `device`."""
+        self.loader = loader
+        self.device = torch.device(device)
+        self.n = n
+        self.half = half
+        self.transform = transform
+        self.cuda = self.device.type == "cuda"
+        self.t = 0.0  # data wait time (s)
+
+    def __len__(self):
+        """Returns the number of batches of the wrapped loader."""
+        return len(self.loader)
+
+    def prepare(self, stream, imgs, targets, paths, shapes):
+        """Moves a collated batch to device and normalizes it, returning it with a CUDA event marking completion."""
+        with torch.cuda.stream(stream) if stream else contextlib.nullcontext():
+            imgs = imgs.to(self.device, non_blocking=True)
+            targets = targets.to(self.device, non_blocking=True)
+            if self.transform:
+                imgs, targets = self.transform(imgs, targets)
+            imgs = imgs.half() if self.half else imgs.float()  # uint8 to fp16/32
+            imgs /= 255  # 0 - 255 to 0.0 - 1.0
+            event = torch.cuda.Event() if stream else None
+            if event:
+                event.record(stream)
+        return imgs, targets, paths, shapes, event
+
+    @staticmethod
+    def put(q, x, stop):
+        """Puts `x` on queue `q` unless `stop` is set first, returns False if stopped."""
+        while not stop.is_set():
+            with contextlib.suppress(queue.Full):
+                q.put(x, timeout=0.1)
+                return True
+        return False
+
+    def run(self, q, stop):
+        """Background thread target, fills queue `q` with prepared batches until the loader ends or `stop` is set."""
+        stream = torch.cuda.Stream(self.device) if self.cuda else None
+        try:
+            for batch in self.loader:
+                if not self.put(q, self.prepare(stream, *batch), stop):
+                    return
+            self.put(q, None, stop)  # end of epoch
+        except Exception as e:
+            self.put(q, e, stop)
+
+    def __iter__(self):
+        """Yields (imgs, targets, paths, shapes) batches as prepared by the background thread."""
+        q, stop = queue.Queue(maxsize=self.n), Event()
+        thread = Thread(target=self.run, args=(q, stop), daemon=True)
+        thread.start()
+        try:
+            while True:
+                t = time.time()
+                x = q.get()
+                self.t += time.time() - t
+                if x is None:
+                    break
+                if isinstance(x, Exception):
+                    raise x
+                imgs, targets, paths, shapes, event = x
+                if event:  # wait for the side-stream copy and keep its memory alive for the consuming stream
+                    current = torch.cuda.current_stream(self.device)
+                    current.wait_event(event)
+                    imgs.record_stream(current)
+                    targets.record_stream(current)
+                yield imgs, targets, paths, shapes
+        finally:
+            stop.set()  # i.e. loop exited early
+            thread.join()
+
+
 class LoadScreenshots:
     # YOLOv5 screenshot dataloader, i.e. `python detect.py --source "screen 0 100 100 512 256"`
     def __init__(self, source, img_size=640, stride=32, auto=True, transforms=None):
@@ -317,8 +538,10 @@ class LoadScreenshots:
 class LoadImages:
     """YOLOv5 image/video dataloader, i.e. `python detect.py --source image.jpg/vid.mp4`"""
 
-    def __init__(self, path, img_size=640, stride=32, auto=True, transforms=None, vid_stride=1):
-        """Initializes YOLOv5 loader for images/videos, supporting glob patterns, directories, and lists of paths."""
+    def __init__(self, path, img_size=640, stride=32, auto=True, transforms=None, vid_stride=1, batch_size=1):
+        """Initializes YOLOv5 loader for images/videos, supporting glob patterns, directories, and lists of paths;
+        `batch_size` > 1 yields images in batches letterboxed to one shape, videos frame by frame.
+        """
         if isinstance(path, str) and Path(path).suffix == ".txt":  # *.txt file with img/vid/dir on each line
             path = Path(path).read_text().rsplit()
         files = []
@@ -346,6 +569,7 @@ class LoadImages:
         self.auto = auto
         self.transforms = transforms  # optional
         self.vid_stride = vid_stride  # video frame-rate stride
+        self.batch_size = batch_size  # images per batch
         if any(videos):
             self._new_video(videos[0])  # new video
         else:
@@ -385,6 +609,23 @@ class LoadImages:
             # im0 = self._cv2_rotate(im0)  # for use if cv2 autorotation is False
             s = f"video {self.count + 1}/{self.nf} ({self.frame}/{self.frames}) {path}: "
 
+        elif self.batch_size > 1:
+            # Read batch of images
+            n = min(self.batch_size, self.video_flag.count(False) - self.count)  # images precede videos in self.files
+            paths = self.files[self.count : self.count + n]
+            im0 = [cv2.imread(f) for f in paths]  # BGR
+            for f, x in zip(paths, im0):
+                assert x is not None, f"Image Not Found {f}"
+            s = f"image {self.count + 1}-{self.count + len(paths)}/{self.nf} {Path(paths[0]).parent}: "
+            self.count += len(paths)
+            if self.transforms:
+                im = np.stack([self.transforms(x) for x in im0])  # transforms
+            else:
+                im = np.stack([letterbox(x, self.img_size, stride=self.stride, auto=False)[0] for x in im0])  # padded
+                im = im[..., ::-1].transpose((0, 3, 1, 2))  # BGR to RGB, BHWC to BCHW
+                im = np.ascontiguousarray(im)  # contiguous
+            return paths, im, im0, self.cap, s
+
         else:
             # Read image
             self.count += 1
@@ -422,8 +663,9 @@ class LoadImages:
         return im
 
     def __len__(self):
-        """Returns the number of files in the dataset."""
-        return self.nf  # number of files
+        """Returns the number of image batches plus videos in the dataset."""
+        ni = self.video_flag.count(False)  # number of images
+        return math.ceil(ni / self.batch_size) + self.nf - ni
 
 
 class LoadStreams:
@@ -510,7 +752,10 @@ class LoadStreams:
         if self.transforms:
             im = np.stack([self.transforms(x) for x in im0])  # transforms
         else:
-            im = np.stack([letterbox(x, self.img_size, stride=self.stride, auto=self.auto)[0] for x in im0])  # resize
+            if len({x.shape for x in im0}) == 1:  # same-shape streams, letterbox as one batch
+                im = letterbox_batch(np.stack(im0), self.img_size, stride=self.stride, auto=self.auto)[0]
+            else:
+                im = np.stack([letterbox(x, self.img_size, stride=self.stride, auto=self.auto)[0] for x in im0])
             im = im[..., ::-1].transpose((0, 3, 1, 2))  # BGR to RGB, BHWC to BCHW
             im = np.ascontiguousarray(im)  # contiguous
 
@@ -529,9 +774,120 @@ def img2label_paths(img_paths):
     return [sb.join(x.rsplit(sa, 1)).rsplit(".", 1)[0] + ".txt" for x in img_paths]
 
 
+class LabelStore:
+    """
+    Columnar dataset labels saved next to *.cache files, memory-mapped on load and viewed lazily per image.
+
+    Columns
+        labels:           (nl, 5) float32 class, xywhn of all images
+        label_offsets:    (n + 1,) int64 start of each image in labels
+        shapes:           (n, 2) int64 image wh
+        points:           (np, 2) float32 xyn of all segment polygons
+        point_offsets:    (ns + 1,) int64 start of each segment in points
+        segment_offsets:  (n + 1,) int64 start of each image's segments in point_offsets
+        stats:            (n, 8) int64 image size, mtime_ns, label size, mtime_ns, missing, found, empty, corrupt
+    """
+
+    columns = "labels", "label_offsets", "shapes", "points", "point_offsets", "segment_offsets", "stats"
+
+    def __init__(self, path=None, **columns):
+        """Initializes a LabelStore from column arrays, `path` is set when they are memory-mapped from disk."""
+        self.path, self.single_cls = path, False
+        for k in self.columns:
+            setattr(self, k, columns[k])
+
+    @classmethod
+    def from_items(cls, items):
+        """Builds a LabelStore from per-image (labels, shape, segments, stats) tuples."""
+        labels, shapes, segments, stats = zip(*items) if items else ([], [], [], [])
+        points = [x for s in segments for x in s]
+
+        def offsets(x):
+            return np.cumsum([0] + [len(y) for y in x], dtype=np.int64)
+
+        return cls(
+            labels=np.concatenate([np.zeros((0, 5), np.float32), *labels], 0).astype(np.float32),
+            label_offsets=offsets(labels),
+            shapes=np.array(shapes, dtype=np.int64).reshape(-1, 2),
+            points=np.concatenate([np.zeros((0, 2), np.float32), *points], 0).astype(np.float32),
+            point_offsets=offsets(points),
+            segment_offsets=offsets(segments),
+            stats=np.array(stats, dtype=np.int64).reshape(-1, 8),
+        )
+
+    @classmethod
+    def load(cls, path, n=None):
+        """Memory-maps the columns saved for `path`, optionally asserting they hold `n` images."""
+        x = {k: np.load(f"{path}.{k}.npy", mmap_mode="r").view(np.ndarray) for k in cls.columns}
+        assert n is None or len(x["shapes"]) == n, f"{path} label columns out of date"
+        return cls(path=path, **x)
+
+    def save(self, path):
+        """Saves each column to a `{path}.{column}.npy` file, written to a temporary file and then atomically replaced
+        so other processes keep valid memory maps of the previous columns.
+        """
+        for k in self.columns:
+            f = f"{path}.{k}.npy"
+            with open(f"{f}.{os.getpid()}.tmp", "wb") as tmp:
+                np.save(tmp, getattr(self, k))
+            os.replace(tmp.name, f)
+
+    def labels_at(self, i):
+        """Returns the (n, 5) label view of image `i`."""
+        return self.labels[self.label_offsets[i] : self.label_offsets[i + 1]]
+
+    def segments_at(self, i):
+        """Returns the list of (n, 2) segment views of image `i`."""
+        o = self.point_offsets[self.segment_offsets[i] : self.segment_offsets[i + 1] + 1]
+        return [self.points[a:b] for a, b in zip(o[:-1], o[1:])]
+
+    def get_labels(self, i):
+        """Returns the labels of image `i`, as a copy with all classes set to 0 for single-class training."""
+        x = self.labels_at(i)
+        if self.single_cls:
+            x = x.copy()
+            x[:, 0] = 0
+        return x
+
+    def __getstate__(self):
+        """Pickles memory-mapped stores by path so spawned DataLoader workers re-map instead of copying columns."""
+        if self.path is None:
+            return self.__dict__
+        return {"path": self.path, "single_cls": self.single_cls}
+
+    def __setstate__(self, state):
+        """Restores a pickled store, re-mapping its columns from disk if it was saved."""
+        if "labels" not in state:
+            single_cls, state = state["single_cls"], LabelStore.load(state["path"]).__dict__
+            state["single_cls"] = single_cls
+        self.__dict__.update(state)
+
+
+class LabelView:
+    """Lazy sequence of per-image arrays returned by `fcn(i)`, reindexable with NumPy index arrays."""
+
+    def __init__(self, fcn, index):
+        """Initializes a view over the images `index` of `fcn`, i.e. LabelStore.get_labels."""
+        self.fcn, self.index = fcn, np.asarray(index)
+
+    def __len__(self):
+        """Returns the number of images in the view."""
+        return len(self.index)
+
+    def __getitem__(self, i):
+        """Returns the array of image `i`, or a reindexed LabelView for slices and index arrays."""
+        if isinstance(i, (int, np.integer)):
+            return self.fcn(self.index[i])
+        return LabelView(self.fcn, self.index[i])
+
+    def __iter__(self):
+        """Yields the array of each image in the view."""
+        return (self.fcn(i) for i in self.index)
+
+
 class LoadImagesAndLabels(Dataset):
     # YOLOv5 train_loader/val_loader, loads images and labels for training and validation
-    cache_version = 0.6  # dataset labels *.cache version
+    cache_version = 0.8  # dataset labels *.cache version
     rand_interp_methods = [cv2.INTER_NEAREST, cv2.INTER_LINEAR, cv2.INTER_CUBIC, cv2.INTER_AREA, cv2.INTER_LANCZOS4]
 
     def __init__(
@@ -551,17 +907,24 @@ class LoadImagesAndLabels(Dataset):
         prefix="",
         rank=-1,
         seed=0,
+        decoder="cv2",
+        batch_augment=False,
     ):
         self.img_size = img_size
         self.augment = augment
         self.hyp = hyp
         self.image_weights = image_weights
         self.rect = False if image_weights else rect
-        self.mosaic = self.augment and not self.rect  # load 4 images at a time into a mosaic (only during training)
+        self.batch_augment = augment and batch_augment  # mosaic, perspective, HSV and flips applied by BatchAugment
+        if self.batch_augment and self.rect:
+            LOGGER.warning("WARNING ⚠️ --batch-augment requires square batches, disabling it for --rect")
+            self.batch_augment = False
+        self.mosaic = self.augment and not self.rect and not self.batch_augment  # load 4 images at a time into a mosaic
         self.mosaic_border = [-img_size // 2, -img_size // 2]
         self.stride = stride
         self.path = path
         self.albumentations = Albumentations(size=img_size) if augment else None
+        self.imread = IMAGE_DECODERS[decoder]  # image decoder backend
 
         try:
             f = []  # image files
@@ -587,12 +950,15 @@ class LoadImagesAndLabels(Dataset):
         # Check cache
         self.label_files = img2label_paths(self.im_files)  # labels
         cache_path = (p if p.is_file() else Path(self.label_files[0]).parent).with_suffix(".cache")
+        cache, exists = None, False
         try:
-            cache, exists = np.load(cache_path, allow_pickle=True).item(), True  # load dict
+            cache = np.load(cache_path, allow_pickle=True).item()  # load dict
             assert cache["version"] == self.cache_version  # matches current version
+            cache["store"] = LabelStore.load(cache_path, n=len(cache["im_files"]))  # memory-mapped label columns
             assert cache["hash"] == get_hash(self.label_files + self.im_files)  # identical hash
+            exists = True
         except Exception:
-            cache, exists = self.cache_labels(cache_path, prefix), False  # run cache ops
+            cache = self.cache_labels(cache_path, prefix, cache)  # run cache ops, reusing unchanged entries
 
         # Display cache
         nf, nm, ne, nc, n = cache.pop("results")  # found, missing, empty, corrupt, total
@@ -600,27 +966,28 @@ class LoadImagesAndLabels(Dataset):
             d = f"Scanning {cache_path}... {nf} images, {nm + ne} backgrounds, {nc} corrupt"
             tqdm(None, desc=prefix + d, total=n, initial=n, bar_format=TQDM_BAR_FORMAT)  # display cache results
             if cache["msgs"]:
-                LOGGER.info("\n".join(cache["msgs"]))  # display warnings
+                LOGGER.info("\n".join(cache["msgs"].values()))  # display warnings
         assert nf > 0 or not augment, f"{prefix}No labels found in {cache_path}, can not start training. {HELP_URL}"
 
         # Read cache
-        [cache.pop(k) for k in ("hash", "version", "msgs")]  # remove items
-        labels, shapes, self.segments = zip(*cache.values())
-        nl = len(np.concatenate(labels, 0))  # number of labels
+        store = cache["store"]
+        valid = (store.stats[:, 7] == 0).nonzero()[0]  # exclude corrupt images
+        nl = int(np.diff(store.label_offsets)[valid].sum())  # number of labels
         assert nl > 0 or not augment, f"{prefix}All labels empty in {cache_path}, can not start training. {HELP_URL}"
-        self.labels = list(labels)
-        self.shapes = np.array(shapes)
-        self.im_files = list(cache.keys())  # update
-        self.label_files = img2label_paths(cache.keys())  # update
+        self.labels = LabelView(store.get_labels, valid)
+        self.segments = LabelView(store.segments_at, valid)
+        self.shapes = store.shapes[valid]  # wh
+        self.im_files = [cache["im_files"][i] for i in valid]  # update
+        self.label_files = img2label_paths(self.im_files)  # update
 
         # Filter images
         if min_items:
-            include = np.array([len(x) >= min_items for x in self.labels]).nonzero()[0].astype(int)
+            include = (np.diff(store.label_offsets)[valid] >= min_items).nonzero()[0]
             LOGGER.info(f"{prefix}{n - len(include)}/{n} images filtered from dataset")
             self.im_files = [self.im_files[i] for i in include]
             self.label_files = [self.label_files[i] for i in include]
-            self.labels = [self.labels[i] for i in include]
-            self.segments = [self.segments[i] for i in include]
+            self.labels = self.labels[include]
+            self.segments = self.segments[include]
             self.shapes = self.shapes[include]  # wh
 
         # Create indices
@@ -636,16 +1003,20 @@ class LoadImagesAndLabels(Dataset):
 
         # Update labels
         include_class = []  # filter labels to include only these classes (optional)
-        self.segments = list(self.segments)
-        include_class_array = np.array(include_class).reshape(1, -1)
-        for i, (label, segment) in enumerate(zip(self.labels, self.segments)):
-            if include_class:
+        if include_class:  # materialize filtered copies of the memory-mapped labels
+            labels, segments = list(self.labels), list(self.segments)
+            include_class_array = np.array(include_class).reshape(1, -1)
+            for i, (label, segment) in enumerate(zip(labels, segments)):
                 j = (label[:, 0:1] == include_class_array).any(1)
-                self.labels[i] = label[j]
+                labels[i] = label[j]
                 if segment:
-                    self.segments[i] = [segment[idx] for idx, elem in enumerate(j) if elem]
-            if single_cls:  # single-class training, merge all classes into 0
-                self.labels[i][:, 0] = 0
+                    segments[i] = [segment[idx] for idx, elem in enumerate(j) if elem]
+                if single_cls:  # single-class training, merge all classes into 0
+                    labels[i][:, 0] = 0
+            self.labels = LabelView(labels.__getitem__, range(n))
+            self.segments = LabelView(segments.__getitem__, range(n))
+        elif single_cls:  # single-class training, merge all classes into 0 on access
+            store.single_cls = True
 
         # Rectangular Training
         if self.rect:
@@ -655,8 +1026,8 @@ class LoadImagesAndLabels(Dataset):
             irect = ar.argsort()
             self.im_files = [self.im_files[i] for i in irect]
             self.label_files = [self.label_files[i] for i in irect]
-            self.labels = [self.labels[i] for i in irect]
-            self.segments = [self.segments[i] for i in irect]
+            self.labels = self.labels[irect]
+            self.segments = self.segments[irect]
             self.shapes = s[irect]  # wh
             ar = ar[irect]
 
@@ -673,11 +1044,27 @@ class LoadImagesAndLabels(Dataset):
             self.batch_shapes = np.ceil(np.array(shapes) * img_size / stride + pad).astype(int) * stride
 
         # Cache images into RAM/disk for faster training
-        if cache_images == "ram" and not self.check_cache_ram(prefix=prefix):
-            cache_images = False
         self.ims = [None] * n
         self.npy_files = [Path(f).with_suffix(".npy") for f in self.im_files]
-        if cache_images:
+        shard_dir = cache_path.with_name(f"{cache_path.stem}-{img_size}{'-augment' if augment else ''}.shards")
+        self.shard_dir, self.shard_index, self.shard_mmaps = shard_dir, None, {}  # one directory per resize
+        self.shm, self.shm_name = None, None
+        if cache_images == "ram" and rank > -1:  # DDP, one shared-memory RAM cache per node
+            self.shm_name = f"yolov5-{get_hash(self.im_files)[:20]}-{img_size}"
+            if rank == 0:  # runs before other local ranks, see torch_distributed_zero_first() in create_dataloader()
+                self.shard_index = self.cache_images_to_shared_memory(prefix)
+            else:
+                self.shard_index = self.attach_shared_memory_cache()
+            if self.shard_index is None:  # fall back to a RAM cache per process
+                self.shm_name = None
+        if cache_images == "ram" and self.shard_index is None and not self.check_cache_ram(prefix=prefix):
+            cache_images = False
+        if cache_images == "shard":
+            try:
+                self.shard_index = self.load_shard_index(self.shard_dir)  # reuse existing shards
+            except Exception:
+                self.shard_index = self.cache_images_to_shards(self.shard_dir, prefix)
+        elif cache_images and self.shard_index is None:  # not in shared memory
             b, gb = 0, 1 << 30  # bytes of cached images, bytes per gigabytes
             self.im_hw0, self.im_hw = [None] * n, [None] * n
             fcn = self.cache_images_to_disk if cache_images == "disk" else self.load_image
@@ -711,44 +1098,244 @@ class LoadImagesAndLabels(Dataset):
             )
         return cache
 
-    def cache_labels(self, path=Path("./labels.cache"), prefix=""):
-        """Caches dataset labels, verifies images, reads shapes, and tracks dataset integrity."""
-        x = {}  # dict
-        nm, nf, ne, nc, msgs = 0, 0, 0, 0, []  # number missing, found, empty, corrupt, messages
+    def cache_images_to_shards(self, path, prefix=""):
+        """Packs all resized images into large *.bin shards in `path` plus an offset index, returning the index."""
+        path.mkdir(parents=True, exist_ok=True)
+        (path / "index.npy").unlink(missing_ok=True)  # invalidate any previous index until shards are complete
+        index = np.zeros((self.n, 7), dtype=np.int64)  # shard, offset, h, w, c, h0, w0
+        s, offset, b, gb = 0, 0, 0, 1 << 30  # shard, shard offset, bytes of cached images, bytes per gigabytes
+        f = open(path / f"0.bin.{os.getpid()}.tmp", "wb")  # replaced into place once written, see done()
+        results = ThreadPool(NUM_THREADS).imap(self.load_image, range(self.n))  # all images, shared by DDP ranks
+        pbar = tqdm(results, total=self.n, bar_format=TQDM_BAR_FORMAT, disable=LOCAL_RANK > 0)
+
+        def done(f, s):
+            """Closes temporary shard file `f` and moves it to shard `s`, memmaps of the old shard stay valid."""
+            f.close()
+            os.replace(f.name, path / f"{s}.bin")
+
+        for i, (im, (h0, w0), (h, w)) in enumerate(pbar):
+            if offset and offset + im.nbytes > SHARD_BYTES:  # start a new shard
+                done(f, s)
+                s, offset = s + 1, 0
+                f = open(path / f"{s}.bin.{os.getpid()}.tmp", "wb")
+            im.tofile(f)
+            index[i] = s, offset, h, w, im.shape[2], h0, w0
+            offset += im.nbytes
+            b += im.nbytes
+            pbar.desc = f"{prefix}Caching images ({b / gb:.1f}GB shard)"
+        done(f, s)
+        pbar.close()
+        x = {
+            "hash": self.images_hash(),
+            "im_files": self.im_files,
+            "index": index,
+            "img_size": self.img_size,
+            "augment": self.augment,  # resize interpolation depends on augment
+            "version": self.cache_version,
+        }
+        with open(path / f"index.npy.{os.getpid()}.tmp", "wb") as f:
+            np.save(f, x)
+        os.replace(f.name, path / "index.npy")  # written last, shards are only valid once the index exists
+        LOGGER.info(f"{prefix}New image shards created: {path} ({s + 1} shards)")
+        return index
+
+    def images_hash(self):
+        """Returns a SHA256 hash of image paths, sizes and modification times, independent of image order."""
+        with ThreadPool(NUM_THREADS) as pool:
+            st = pool.map(file_stat, self.im_files)
+        return hashlib.sha256(str(sorted(zip(self.im_files, st))).encode()).hexdigest()
+
+    def load_shard_index(self, path):
+        """Loads a shard index from `path`, returning offsets ordered like `self.im_files`; raises if out of date."""
+        x = np.load(path / "index.npy", allow_pickle=True).item()
+        assert x["version"] == self.cache_version  # matches current version
+        assert x["img_size"] == self.img_size and x["augment"] == self.augment  # identical resize
+        assert x["hash"] == self.images_hash()  # no images added, removed or edited
+        pos = {f: j for j, f in enumerate(x["im_files"])}
+        return x["index"][[pos[f] for f in self.im_files]]  # KeyError if any image is not in the shards
+
+    def shared_memory_layout(self):
+        """Returns a shard index (see cache_images_to_shards) of all resized images packed into one contiguous block."""
+        index = np.zeros((self.n, 7), dtype=np.int64)  # shard, offset, h, w, c, h0, w0
+        w0, h0 = self.shapes.T  # wh
+        r = self.img_size / np.maximum(h0, w0)  # ratio, as in load_image()
+        index[:, 2], index[:, 3], index[:, 4] = np.ceil(h0 * r), np.ceil(w0 * r), 3  # resized BGR hwc
+        index[:, 5], index[:, 6] = h0, w0
+        nbytes = index[:, 2] * index[:, 3] * index[:, 4]
+        index[:, 1] = nbytes.cumsum() - nbytes
+        return index
+
+    def cache_images_to_shared_memory(self, prefix=""):
+        """Fills one POSIX shared-memory block with all resized images on local rank 0, returning its shard index, or
+        None if /dev/shm is too small.
+        """
+        index = self.shared_memory_layout()
+        with contextlib.suppress(FileNotFoundError):
+            attach_shared_memory(self.shm_name).unlink()  # stale block from a crashed run, never attached by others
+        size = SHM_HEADER + int(index[-1, 1] + index[-1, 2] * index[-1, 3] * index[-1, 4])
+        if os.path.isdir("/dev/shm"):  # Linux tmpfs, 64MB by default in Docker
+            free, gb = shutil.disk_usage("/dev/shm").free, 1 << 30
+            if size > free:
+                LOGGER.warning(
+                    f"{prefix}WARNING ⚠️ {size / gb:.1f}GB shared memory required, {free / gb:.1f}GB free in /dev/shm, "
+                    f"caching images per process instead. Increase /dev/shm, i.e. docker run --shm-size"
+                )
+                return None
+        self.shm = shared_memory.SharedMemory(self.shm_name, create=True, size=size)
+        atexit.register(self.shm.unlink)  # mappings held by other ranks stay valid until they exit
+        buf = np.ndarray(size - SHM_HEADER, dtype=np.uint8, buffer=self.shm.buf, offset=SHM_HEADER)
+        b, gb = 0, 1 << 30  # bytes of cached images, bytes per gigabytes
+        results = ThreadPool(NUM_THREADS).imap(self.load_image, range(self.n))  # all images, shared by DDP ranks
+        pbar = tqdm(results, total=self.n, bar_format=TQDM_BAR_FORMAT, disable=LOCAL_RANK > 0)
+        for i, (im, _, _) in enumerate(pbar):
+            _, o, h, w, c, _, _ = index[i]
+            if im.shape[:2] != (h, w):  # label cache shape disagrees with decoded image, i.e. EXIF
+                im = cv2.resize(im, (int(w), int(h)), interpolation=cv2.INTER_AREA)
+            buf[o : o + h * w * c] = im.reshape(-1)
+            b += im.nbytes
+            pbar.desc = f"{prefix}Caching images ({b / gb:.1f}GB shared ram)"
+        pbar.close()
+        self.shm.buf[0] = 1  # complete, other local ranks may attach
+        return index
+
+    def attach_shared_memory_cache(self):
+        """Attaches to the shared-memory RAM cache of local rank 0, returning its shard index, or None if local rank 0
+        did not create or complete it.
+        """
+        try:
+            shm = attach_shared_memory(self.shm_name)
+        except FileNotFoundError:  # local rank 0 did not cache
+            return None
+        if shm.buf[0] != 1:  # incomplete
+            shm.close()
+            return None
+        self.shm = shm
+        return self.shared_memory_layout()
+
+    def load_shard(self, s):
+        """Returns shard `s` as a read-only uint8 memmap or shared-memory view, opened lazily once per process."""
+        if s not in self.shard_mmaps:
+            if self.shm_name:  # single shared-memory block, see cache_images_to_shared_memory()
+                self.shm = self.shm or attach_shared_memory(self.shm_name)
+                x = np.ndarray(self.shm.size - SHM_HEADER, dtype=np.uint8, buffer=self.shm.buf, offset=SHM_HEADER)
+                x.flags.writeable = False
+                self.shard_mmaps[s] = x
+            else:
+                self.shard_mmaps[s] = np.memmap(self.shard_dir / f"{s}.bin", dtype=np.uint8, mode="r")
+        return self.shard_mmaps[s]
+
+    def __getstate__(self):
+        """Drops open shard memmaps when pickled to spawned DataLoader workers, which re-open them lazily."""
+        state = self.__dict__.copy()
+        state["shard_mmaps"], state["shm"] = {}, None
+        return state
+
+    def cache_labels(self, path=Path("./labels.cache"), prefix="", cache=None):
+        """Caches dataset labels, verifies images, reads shapes, and tracks dataset integrity; only files added or
+        changed (by size/mtime) since a previous `cache` dict are re-verified. Progress is journaled to *.cache.part so
+        an interrupted scan resumes, and known-corrupt files in the *.errors index are skipped without being opened.
+        """
+        items, msgs, new = [], {}, {}  # per-file (labels, shape, segments, stats), messages, newly verified results
+        old = cache if cache and cache.get("version") == self.cache_version and "store" in cache else None
+        pos = {f: j for j, f in enumerate(old["im_files"])} if old else {}  # row of each file in the old store
+        files = list(zip(self.im_files, self.label_files))
+        with ThreadPool(NUM_THREADS) as pool:
+            st = pool.map(lambda f: file_stat(f[0]) + file_stat(f[1]), files)  # (size, mtime) of image and label
+        todo = [(*f, s) for f, s in zip(files, st) if f[0] not in pos or tuple(old["store"].stats[pos[f[0]], :4]) != s]
+
+        # Resume from an interrupted scan and skip known-corrupt files, both only while their stats are unchanged
+        part, errors_path = path.with_suffix(".cache.part"), path.with_suffix(".errors")
+        done, errors = load_scan_journal(part), load_error_index(errors_path)
+        verify = []
+        for f, lb_file, s in todo:
+            if f in done and done[f][2][:4] == s:
+                new[f] = done[f]
+                if done[f][2][7]:  # corrupt
+                    errors[f] = {"status": "corrupt", "stats": done[f][2], "msg": done[f][1]}
+            elif f in errors and errors[f]["status"] == "corrupt" and tuple(errors[f]["stats"][:4]) == s:
+                new[f] = ((np.zeros((0, 5), dtype=np.float32), (0, 0), []), errors[f]["msg"], tuple(errors[f]["stats"]))
+            else:
+                verify.append((f, lb_file, s))
+        if len(verify) < len(todo):
+            n = len(todo) - len(verify)
+            LOGGER.info(f"{prefix}{n} files resumed from {part.name} or skipped as corrupt by {errors_path.name}")
+
+        nm, nf, ne, nc = 0, 0, 0, 0  # number missing, found, empty, corrupt
         desc = f"{prefix}Scanning {path.parent / path.stem}..."
+        try:
+            journal = open(part, "ab")
+        except OSError:
+            journal = None  # not writeable, scan without checkpoints
+        chunk, t = [], time.time()
         with Pool(NUM_THREADS) as pool:
             pbar = tqdm(
-                pool.imap(verify_image_label, zip(self.im_files, self.label_files, repeat(prefix))),
+                pool.imap(verify_image_label, [(im_file, lb_file, prefix) for im_file, lb_file, _ in verify]),
                 desc=desc,
-                total=len(self.im_files),
+                total=len(verify),
                 bar_format=TQDM_BAR_FORMAT,
             )
-            for im_file, lb, shape, segments, nm_f, nf_f, ne_f, nc_f, msg in pbar:
+            for (f, lb_file, s), (im_file, lb, shape, segments, nm_f, nf_f, ne_f, nc_f, msg) in zip(verify, pbar):
                 nm += nm_f
                 nf += nf_f
                 ne += ne_f
                 nc += nc_f
-                if im_file:
-                    x[im_file] = [lb, shape, segments]
-                if msg:
-                    msgs.append(msg)
+                if not im_file:  # corrupt, keep an empty row so it is not re-verified until it changes
+                    lb, shape, segments = np.zeros((0, 5), dtype=np.float32), (0, 0), []
+                stats = file_stat(f) + file_stat(lb_file) + (nm_f, nf_f, ne_f, nc_f)  # stat after JPEG restore
+                new[f] = (lb, shape, segments), msg, stats
+                if nc_f or stats[:2] != s[:2]:  # corrupt, or image re-encoded by the corrupt JPEG restore
+                    errors[f] = {"status": "corrupt" if nc_f else "repaired", "stats": stats, "msg": msg}
+                else:
+                    errors.pop(f, None)  # fixed since last listed
+                chunk.append((f, new[f]))
+                if journal and (len(chunk) >= 1000 or time.time() - t > 30):  # checkpoint
+                    pickle.dump(chunk, journal)
+                    journal.flush()
+                    chunk, t = [], time.time()
                 pbar.desc = f"{desc} {nf} images, {nm + ne} backgrounds, {nc} corrupt"
 
         pbar.close()
+        if journal:
+            journal.close()
+        for f, lb_file in files:  # merge into dataset order, removed files drop out
+            if f in new:
+                (lb, shape, segments), msg, stats = new[f]
+                items.append((lb, shape, segments, stats))
+            else:
+                j, store = pos[f], old["store"]
+                lb, segments = store.labels_at(j), store.segments_at(j)
+                items.append((lb, store.shapes[j], segments, store.stats[j]))
+                msg = old["msgs"].get(f)
+            if msg:
+                msgs[f] = msg
+        store = LabelStore.from_items(items)  # copies columns, so the previous store can be unmapped
+        items = lb = segments = None  # release views into the previous store
+        if old:
+            old["store"] = None  # close its memory maps before save() replaces the column files
+        nm, nf, ne, nc = store.stats[:, 4:].sum(0).tolist()
+        if len(todo) < len(files):
+            LOGGER.info(f"{prefix}{len(todo)} added or changed files verified, {len(files) - len(todo)} unchanged")
         if msgs:
-            LOGGER.info("\n".join(msgs))
+            LOGGER.info("\n".join(msgs.values()))
         if nf == 0:
             LOGGER.warning(f"{prefix}WARNING ⚠️ No labels found in {path}. {HELP_URL}")
+        x = {"im_files": [f for f, _ in files]}  # all scanned files, row order of the label store columns
         x["hash"] = get_hash(self.label_files + self.im_files)
         x["results"] = nf, nm, ne, nc, len(self.im_files)
         x["msgs"] = msgs  # warnings
         x["version"] = self.cache_version  # cache version
         try:
+            store.save(path)  # columns first, the *.cache dict last
             np.save(path, x)  # save cache for next time
             path.with_suffix(".cache.npy").rename(path)  # remove .npy suffix
+            store = LabelStore.load(path, n=len(files))  # memory-map instead of holding columns in RAM
+            part.unlink(missing_ok=True)  # scan complete, drop journal
+            im_files = set(self.im_files)
+            errors_path.write_text(json.dumps({k: v for k, v in errors.items() if k in im_files}, indent=1))
             LOGGER.info(f"{prefix}New cache created: {path}")
         except Exception as e:
             LOGGER.warning(f"{prefix}WARNING ⚠️ Cache directory {path.parent} is not writeable: {e}")  # not writeable
+        x["store"] = store
         return x
 
     def __len__(self):
@@ -789,7 +1376,7 @@ class LoadImagesAndLabels(Dataset):
             if labels.size:  # normalized xywh to pixel xyxy format
                 labels[:, 1:] = xywhn2xyxy(labels[:, 1:], ratio[0] * w, ratio[1] * h, padw=pad[0], padh=pad[1])
 
-            if self.augment:
+            if self.augment and not self.batch_augment:
                 img, labels = random_perspective(
                     img,
                     labels,
@@ -809,6 +1396,7 @@ class LoadImagesAndLabels(Dataset):
             img, labels = self.albumentations(img, labels)
             nl = len(labels)  # update after albumentations
 
+        if self.augment and not self.batch_augment:
             # HSV color-space
             augment_hsv(img, hgain=hyp["hsv_h"], sgain=hyp["hsv_s"], vgain=hyp["hsv_v"])
 
@@ -844,6 +1432,9 @@ class LoadImagesAndLabels(Dataset):
 
         Returns (im, original hw, resized hw)
         """
+        if self.shard_index is not None:  # zero-copy view into a memory-mapped shard
+            s, o, h, w, c, h0, w0 = self.shard_index[i]
+            return self.load_shard(s)[o : o + h * w * c].reshape(h, w, c), (h0, w0), (h, w)
         im, f, fn = (
             self.ims[i],
             self.im_files[i],
@@ -852,10 +1443,9 @@ class LoadImagesAndLabels(Dataset):
         if im is None:  # not cached in RAM
             if fn.exists():  # load npy
                 im = np.load(fn)
+                h0, w0 = im.shape[:2]  # orig hw
             else:  # read image
-                im = cv2.imread(f)  # BGR
-                assert im is not None, f"Image Not Found {f}"
-            h0, w0 = im.shape[:2]  # orig hw
+                im, (h0, w0) = self.imread(f, self.img_size, self.shapes[i][::-1])  # BGR, orig hw
             r = self.img_size / max(h0, w0)  # ratio
             if r != 1:  # if sizes are not equal
                 interp = cv2.INTER_LINEAR if (self.augment or r > 1) else cv2.INTER_AREA
@@ -1047,6 +1637,197 @@ class LoadImagesAndLabels(Dataset):
         return torch.stack(im4, 0), torch.cat(label4, 0), path4, shapes4
 
 
+class LoadImagesAndLabelsStream(IterableDataset, LoadImagesAndLabels):
+    """
+    YOLOv5 streaming train_loader/val_loader, reads (image, label) pairs sequentially from WebDataset-style tar shards.
+
+    Each shard holds `key.jpg` image and `key.txt` label members, empty for background images (see
+    make_tar_shards()). Shards are split across DDP ranks and DataLoader workers, and samples pass through a shuffle
+    buffer that also supplies mosaic partners. Items and collate_fn match LoadImagesAndLabels.
+
+    Usage
+        dataset = LoadImagesAndLabelsStream('shards/shard-{000000..000099}.tar', 640, augment=True, hyp=hyp, n=1000000)
+    """
+
+    def __init__(
+        self,
+        path,
+        img_size=640,
+        augment=False,
+        hyp=None,
+        single_cls=False,
+        stride=32,
+        buffer=1000,
+        n=None,
+        prefix="",
+        rank=-1,
+        seed=0,
+    ):
+        """Initializes a stream over tar shards in `path` (dir, *.txt list, list or brace pattern) without scanning
+        their contents; `n` total images is counted from shard headers if not given.
+        """
+        self.img_size = img_size
+        self.augment = augment
+        self.hyp = hyp
+        self.image_weights = False
+        self.rect = False
+        self.batch_augment = False
+        self.mosaic = augment  # mosaic partners come from the shuffle buffer
+        self.mosaic_border = [-img_size // 2, -img_size // 2]
+        self.stride = stride
+        self.albumentations = Albumentations(size=img_size) if augment else None
+        self.single_cls = single_cls
+        self.buffer = buffer
+        self.prefix = prefix
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+
+        shards = []
+        for p in path if isinstance(path, (list, tuple)) else [path]:
+            p = str(p)
+            if m := re.search(r"\{(\d+)\.\.(\d+)\}", p):  # brace pattern, i.e. shard-{000000..000099}.tar
+                a, b = m.groups()
+                shards += [p[: m.start()] + str(i).zfill(len(a)) + p[m.end() :] for i in range(int(a), int(b) + 1)]
+            elif os.path.isdir(p):
+                shards += sorted(glob.glob(os.path.join(p, "*.tar")))
+            elif p.endswith(".txt"):
+                shards += Path(p).read_text().split()
+            else:
+                shards.append(p)
+        assert shards, f"{prefix}No tar shards found in {path}. {HELP_URL}"
+        assert rank == -1 or len(shards) >= WORLD_SIZE, f"{prefix}{len(shards)} shards < {WORLD_SIZE} DDP ranks"
+        self.shards = shards
+        self.n = n if n is not None else sum(self.count(s) for s in shards)
+
+        # Shuffle buffer, indexed by LoadImagesAndLabels.__getitem__() and load_mosaic()
+        self.ims, self.im_hw0, self.im_hw, self.labels, self.segments, self.im_files = [], [], [], [], [], []
+        self.indices = range(0)
+
+    def __len__(self):
+        """Returns the number of images streamed by this rank per epoch."""
+        return self.n if self.rank == -1 else self.n // WORLD_SIZE
+
+    def set_epoch(self, epoch):
+        """Sets the epoch used to reshuffle shard order, call before creating each epoch's iterator."""
+        self.epoch = epoch
+
+    @staticmethod
+    def count(shard):
+        """Counts the image members of a tar shard from its headers."""
+        with tarfile.open(shard) as tar:
+            return sum(m.name.rsplit(".", 1)[-1].lower() in IMG_FORMATS for m in tar.getmembers())
+
+    def worker_shards(self):
+        """Returns the shards read by this DDP rank and DataLoader worker, in an epoch-shuffled order."""
+        shards = self.shards.copy()
+        if self.augment:
+            random.Random(self.seed + self.epoch).shuffle(shards)  # identical order in every rank and worker
+        if self.rank != -1:
+            shards = shards[RANK % WORLD_SIZE :: WORLD_SIZE]
+        info = get_worker_info()
+        if info is not None:
+            # a worker left without shards when workers outnumber shards re-reads one, to meet its quota
+            shards = shards[info.id :: info.num_workers] or [shards[info.id % len(shards)]]
+        return shards
+
+    def worker_quota(self):
+        """Returns the images this DDP worker streams per epoch, equal across ranks; None outside DDP."""
+        if self.rank == -1:
+            return None
+        n = len(self)
+        info = get_worker_info()
+        if info is not None:
+            n = n // info.num_workers + (info.id < n % info.num_workers)
+        return n
+
+    def cycle(self, shards):
+        """Yields samples from `shards` repeatedly, stopping if a full pass yields none."""
+        while True:
+            empty = True
+            for x in self.samples(shards):
+                empty = False
+                yield x
+            if empty:
+                return
+
+    def samples(self, shards):
+        """Yields decoded (im, hw0, hw, labels, segments, file) samples read sequentially from `shards`."""
+        for shard in shards:
+            with tarfile.open(shard, "r|*") as tar:  # streaming mode, no seeks
+                key, sample = None, {}
+                for m in chain(tar, [None]):  # None flushes the last sample
+                    tar.members = []  # do not accumulate headers of read members
+                    if m and not (m.isfile() and "." in m.name.rsplit("/", 1)[-1]):
+                        continue  # directories, links and members without an extension
+                    k, ext = m.name.rsplit(".", 1) if m else (None, None)
+                    if key is not None and k != key:  # end of sample
+                        if "txt" in sample and any(x in IMG_FORMATS for x in sample):
+                            x = self.decode(f"{shard}/{key}", sample)
+                            if x is not None:
+                                yield x
+                        else:
+                            msg = f"{self.prefix}WARNING ⚠️ {shard}/{key}: ignoring sample without image or label"
+                            LOGGER.warning(msg)
+                        sample = {}
+                    if m:
+                        key, sample[ext.lower()] = k, tar.extractfile(m).read()
+
+    def decode(self, f, sample):
+        """Decodes an image and its labels from tar member bytes, resized as load_image(); returns None if invalid."""
+        try:
+            data = next(v for k, v in sample.items() if k in IMG_FORMATS)
+            im = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)  # BGR
+            assert im is not None, "image decode failed"
+            lb, segments = parse_label(sample.get("txt", b"").decode())
+            lb = lb.reshape(-1, 5)
+            if self.single_cls:  # single-class training, merge all classes into 0
+                lb[:, 0] = 0
+        except Exception as e:
+            LOGGER.warning(f"{self.prefix}WARNING ⚠️ {f}: ignoring corrupt image/label: {e}")
+            return None
+        h0, w0 = im.shape[:2]  # orig hw
+        r = self.img_size / max(h0, w0)  # ratio
+        if r != 1:  # if sizes are not equal
+            interp = cv2.INTER_LINEAR if (self.augment or r > 1) else cv2.INTER_AREA
+            im = cv2.resize(im, (math.ceil(w0 * r), math.ceil(h0 * r)), interpolation=interp)
+        return im, (h0, w0), im.shape[:2], lb, segments, f
+
+    def load_image(self, i):
+        """Returns buffered image `i` as (im, original hw, resized hw)."""
+        return self.ims[i], self.im_hw0[i], self.im_hw[i]
+
+    def put(self, i, x):
+        """Stores decoded sample `x` at buffer slot `i`, appending when `i` is the buffer length."""
+        for b, v in zip((self.ims, self.im_hw0, self.im_hw, self.labels, self.segments, self.im_files), x):
+            if i == len(b):
+                b.append(v)
+            else:
+                b[i] = v
+        self.indices = range(len(self.ims))
+
+    def __iter__(self):
+        """Yields LoadImagesAndLabels items from this worker's shards, in shuffle-buffer order when augmenting."""
+        self.ims, self.im_hw0, self.im_hw, self.labels, self.segments, self.im_files = [], [], [], [], [], []
+        buffer = self.buffer if self.augment else 1  # no shuffle for validation
+        shards, quota = self.worker_shards(), self.worker_quota()
+        source = self.samples(shards) if quota is None else islice(self.cycle(shards), quota)  # equal length DDP ranks
+        for x in source:
+            if len(self.ims) < buffer:  # fill buffer
+                self.put(len(self.ims), x)
+                continue
+            i = random.randrange(len(self.ims))
+            yield self[i]
+            self.put(i, x)  # replace
+        while self.ims:  # drain buffer
+            i = random.randrange(len(self.ims))
+            yield self[i]
+            last = [b.pop() for b in (self.ims, self.im_hw0, self.im_hw, self.labels, self.segments, self.im_files)]
+            if i < len(self.ims):
+                self.put(i, last)  # swap-remove
+            self.indices = range(len(self.ims))
+
+
 # Ancillary functions --------------------------------------------------------------------------------------------------
 def flatten_recursive(path=DATASETS_DIR / "coco128"):
     """Flattens a directory by copying all files from subdirectories to a new top-level directory, preserving
@@ -1125,6 +1906,44 @@ def autosplit(path=DATASETS_DIR / "coco128/images", weights=(0.9, 0.1, 0.0), ann
                 f.write(f"./{img.relative_to(path.parent).as_posix()}" + "\n")  # add image to txt file
 
 
+def parse_label(text):
+    """Parses YOLO *.txt label text into (n, 5) float32 (cls, xywh) labels and a list of (n, 2) segments."""
+    lb, segments = [x.split() for x in text.strip().splitlines() if len(x)], []
+    if any(len(x) > 6 for x in lb):  # is segment
+        classes = np.array([x[0] for x in lb], dtype=np.float32)
+        segments = [np.array(x[1:], dtype=np.float32).reshape(-1, 2) for x in lb]  # (cls, xy1...)
+        lb = np.concatenate((classes.reshape(-1, 1), segments2boxes(segments)), 1)  # (cls, xywh)
+    return np.array(lb, dtype=np.float32), segments
+
+
+def make_tar_shards(path=DATASETS_DIR / "coco128/images", out=None, samples_per_shard=10000):
+    """Packs a YOLO image directory and its labels into shuffled WebDataset-style tar shards for streaming
+    Usage: from utils.dataloaders import *; make_tar_shards()
+    Arguments
+        path:               Path to images directory
+        out:                Output directory, defaults to path_shards
+        samples_per_shard:  Images per *.tar shard
+    """
+    path = Path(path)  # images dir
+    out = Path(out or f"{path}_shards")
+    out.mkdir(parents=True, exist_ok=True)
+    files = sorted(str(x) for x in path.rglob("*.*") if x.suffix[1:].lower() in IMG_FORMATS)  # image files only
+    random.seed(0)  # for reproducibility
+    random.shuffle(files)  # shuffle once so sequential shard reads are not ordered by class or source
+    n = math.ceil(len(files) / samples_per_shard)  # number of shards
+    for i in tqdm(range(n), desc=f"Writing {n} shards to {out}"):
+        with tarfile.open(out / f"shard-{i:06d}.tar", "w") as tar:
+            for j, f in enumerate(files[i * samples_per_shard : (i + 1) * samples_per_shard]):
+                key = f"{i * samples_per_shard + j:09d}"
+                tar.add(f, arcname=f"{key}{Path(f).suffix.lower()}")
+                lb_file = img2label_paths([f])[0]
+                if os.path.isfile(lb_file):
+                    tar.add(lb_file, arcname=f"{key}.txt")
+                else:  # background image, empty label
+                    tar.addfile(tarfile.TarInfo(f"{key}.txt"))
+    return out
+
+
 def verify_image_label(args):
     """Verifies a single image-label pair, ensuring image format, size, and legal label values."""
     im_file, lb_file, prefix = args
@@ -1147,12 +1966,7 @@ def verify_image_label(args):
         if os.path.isfile(lb_file):
             nf = 1  # label found
             with open(lb_file) as f:
-                lb = [x.split() for x in f.read().strip().splitlines() if len(x)]
-                if any(len(x) > 6 for x in lb):  # is segment
-                    classes = np.array([x[0] for x in lb], dtype=np.float32)
-                    segments = [np.array(x[1:], dtype=np.float32).reshape(-1, 2) for x in lb]  # (cls, xy1...)
-                    lb = np.concatenate((classes.reshape(-1, 1), segments2boxes(segments)), 1)  # (cls, xywh)
-                lb = np.array(lb, dtype=np.float32)
+                lb, segments = parse_label(f.read())
             nl = len(lb)
             if nl:
                 assert lb.shape[1] == 5, f"labels require 5 columns, {lb.shape[1]} columns detected"
@@ -0,0 +1,121 @@
+# YOLOv5 🚀 by Ultralytics, AGPL-3.0 license
+"""
+Run an async ASGI REST API exposing one or more YOLOv5 models, with batch uploads and raw uint8 inputs.
+
+Usage:
+    $ python asgi.py --model yolov5s --port 8000
+    $ curl -X POST -F image=@zidane.jpg -F image=@bus.jpg 'http://localhost:8000/v1/object-detection/yolov5s'
+    $ curl -X POST --data-binary @frames.raw -H 'Accept: application/x-npy' \
+        'http://localhost:8000/v1/object-detection/yolov5s?shape=2,720,1280,3'
+"""
+
+import argparse
+import asyncio
+import io
+import sys
+from pathlib import Path
+
+import cv2
+import numpy as np
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[2]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+
+from utils.serving import ModelRegistry
+
+registry = None  # ModelRegistry, models are loaded on first request
+
+DETECTION_URL = "/v1/object-detection/{model}"
+METRICS_URL = "/v1/metrics"
+
+
+def decode(b):
+    """Decodes JPEG/PNG bytes `b` to an RGB HWC uint8 array."""
+    im = cv2.imdecode(np.frombuffer(b, np.uint8), cv2.IMREAD_COLOR)
+    if im is None:
+        raise ValueError("image could not be decoded, JPEG or PNG expected")
+    return np.ascontiguousarray(im[..., ::-1])  # BGR to RGB, off the event loop
+
+
+def decode_raw(b, shape):
+    """Returns a list of RGB HWC uint8 arrays viewing raw bytes `b` of `shape` (h,w,c) or (n,h,w,c), without copying."""
+    if len(shape) not in (3, 4):
+        raise ValueError(f"shape=h,w,c or n,h,w,c query parameter required for raw uint8 input, got {shape}")
+    x = np.frombuffer(b, np.uint8).reshape(shape)
+    return list(x) if x.ndim == 4 else [x]
+
+
+async def predict(request):
+    """
+    Returns detections for one or more images as compact JSON, [[x1, y1, x2, y2, conf, cls], ...] per image, or as a
+    NumPy structured array (.npy) with 'Accept: application/x-npy'.
+
+    Accepts multipart/form-data with one or more 'image' JPEG/PNG files, or a raw uint8 HWC body with ?shape=h,w,c or
+    ?shape=n,h,w,c. Images are decoded on the default executor and micro-batched with concurrent requests.
+    """
+    name = request.path_params["model"]
+    try:
+        registry.resolve(name)
+    except FileNotFoundError as e:
+        return JSONResponse({"error": str(e)}, status_code=404)
+
+    loop = asyncio.get_running_loop()
+    try:
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            form = await request.form()  # uploads spooled as they stream in
+            data = [await f.read() for f in form.getlist("image")]
+            ims = await asyncio.gather(*(loop.run_in_executor(None, decode, b) for b in data))
+        else:  # raw uint8
+            shape = tuple(int(x) for x in request.query_params.get("shape", "").split(",") if x)
+            ims = await loop.run_in_executor(None, decode_raw, await request.body(), shape)
+    except ValueError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    if not ims:
+        return JSONResponse({"error": "no images received"}, status_code=400)
+
+    futures = await loop.run_in_executor(None, lambda: [registry.submit(name, im) for im in ims])  # may load model
+    results = await asyncio.gather(*map(asyncio.wrap_future, futures))
+    if "application/x-npy" in request.headers.get("accept", ""):
+        a = [r.numpy() for r in results]
+        for i, x in enumerate(a):
+            x["image"] = i  # index in this request
+        f = io.BytesIO()
+        np.save(f, np.concatenate(a))
+        return Response(f.getvalue(), media_type="application/x-npy")
+    return JSONResponse([r.xyxy[0].tolist() for r in results])
+
+
+async def metrics(request):
+    """Returns resident models with latency percentiles, queue depth and batch sizes, and load and eviction timings."""
+    return JSONResponse(registry.metrics())
+
+
+app = Starlette(routes=[Route(DETECTION_URL, predict, methods=["POST"]), Route(METRICS_URL, metrics)])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="ASGI API exposing YOLOv5 model")
+    parser.add_argument("--port", default=8000, type=int, help="port number")
+    parser.add_argument("--weights-dir", default=ROOT / "weights", help="directory of *.pt and exported model weights")
+    parser.add_argument("--model", nargs="*", default=[], help="model(s) to preload, i.e. --model yolov5n yolov5s")
+    parser.add_argument("--device", default="", help="cuda device, i.e. 0 or cpu")
+    parser.add_argument("--budget", default=4.0, type=float, help="GB of resident models before LRU eviction")
+    parser.add_argument("--size", default=640, type=int, help="inference size (pixels)")
+    parser.add_argument("--max-batch", default=8, type=int, help="maximum images per batched forward")
+    parser.add_argument("--max-wait", default=2.0, type=float, help="maximum milliseconds to wait for a batch to fill")
+    opt = parser.parse_args()
+
+    registry = ModelRegistry(
+        opt.weights_dir, opt.device, opt.budget * 1e9, opt.size, opt.max_batch, max_wait=opt.max_wait / 1e3
+    )
+    for m in opt.model:
+        registry.get(m)  # preload
+
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=opt.port)
@@ -3,15 +3,24 @@
 
 import argparse
 import io
+import sys
+from pathlib import Path
 
-import torch
 from flask import Flask, request
 from PIL import Image
 
+FILE = Path(__file__).resolve()
+ROOT = FILE.parents[2]  # YOLOv5 root directory
+if str(ROOT) not in sys.path:
+    sys.path.append(str(ROOT))  # add ROOT to PATH
+
+from utils.serving import ModelRegistry
+
 app = Flask(__name__)
-models = {}
+registry = None  # ModelRegistry, models are loaded on first request
 
 DETECTION_URL = "/v1/object-detection/<model>"
+METRICS_URL = "/v1/metrics"
 
 
 @app.route(DETECTION_URL, methods=["POST"])
@@ -32,18 +41,35 @@ def predict(model):
         im_bytes = im_file.read()
         im = Image.open(io.BytesIO(im_bytes))
 
-        if model in models:
-            results = models[model](im, size=640)  # reduce size=320 for faster inference
-            return results.pandas().xyxy[0].to_json(orient="records")
+        try:
+            results = registry.submit(model, im).result()  # micro-batched with concurrent requests
+        except FileNotFoundError as e:
+            return {"error": str(e)}, 404
+        return results.pandas().xyxy[0].to_json(orient="records")
+
+
+@app.route(METRICS_URL, methods=["GET"])
+def metrics():
+    """Return resident models with latency percentiles, queue depth and batch sizes, and load and eviction timings."""
+    return registry.metrics()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Flask API exposing YOLOv5 model")
     parser.add_argument("--port", default=5000, type=int, help="port number")
-    parser.add_argument("--model", nargs="+", default=["yolov5s"], help="model(s) to run, i.e. --model yolov5n yolov5s")
+    parser.add_argument("--weights-dir", default=ROOT / "weights", help="directory of *.pt and exported model weights")
+    parser.add_argument("--model", nargs="*", default=[], help="model(s) to preload, i.e. --model yolov5n yolov5s")
+    parser.add_argument("--device", default="", help="cuda device, i.e. 0 or cpu")
+    parser.add_argument("--budget", default=4.0, type=float, help="GB of resident models before LRU eviction")
+    parser.add_argument("--size", default=640, type=int, help="inference size (pixels)")
+    parser.add_argument("--max-batch", default=8, type=int, help="maximum images per batched forward")
+    parser.add_argument("--max-wait", default=2.0, type=float, help="maximum milliseconds to wait for a batch to fill")
     opt = parser.parse_args()
 
+    registry = ModelRegistry(
+        opt.weights_dir, opt.device, opt.budget * 1e9, opt.size, opt.max_batch, max_wait=opt.max_wait / 1e3
+    )
     for m in opt.model:
-        models[m] = torch.hub.load("ultralytics/yolov5", m, force_reload=True, skip_validation=True)
+        registry.get(m)  # preload
 
-    app.run(host="0.0.0.0", port=opt.port)  # debug=True causes Restarting with stat
+    app.run(host="0.0.0.0", port=opt.port, threaded=True)  # debug=True causes Restarting with stat
@@ -2,6 +2,7 @@
 """General utils."""
 
 import contextlib
+import csv
 import glob
 import inspect
 import logging
@@ -9,6 +10,7 @@ import logging.config
 import math
 import os
 import platform
+import queue
 import random
 import re
 import signal
@@ -23,6 +25,7 @@ from multiprocessing.pool import ThreadPool
 from pathlib import Path
 from subprocess import check_output
 from tarfile import is_tarfile
+from threading import Thread
 from typing import Optional
 from zipfile import ZipFile, is_zipfile
 
@@ -47,7 +50,7 @@ from ultralytics.utils.checks import check_requirements
 
 from utils import TryExcept, emojis
 from utils.downloads import curl_download, gsutil_getsize
-from utils.metrics import box_iou, fitness
+from utils.metrics import bbox_iou, box_iou, fitness
 
 FILE = Path(__file__).resolve()
 ROOT = FILE.parents[1]  # YOLOv5 root directory
@@ -58,8 +61,11 @@ NUM_THREADS = min(8, max(1, os.cpu_count() - 1))  # number of YOLOv5 multiproces
 DATASETS_DIR = Path(os.getenv("YOLOv5_DATASETS_DIR", ROOT.parent / "datasets"))  # global datasets directory
 AUTOINSTALL = str(os.getenv("YOLOv5_AUTOINSTALL", True)).lower() == "true"  # global auto-install mode
 VERBOSE = str(os.getenv("YOLOv5_VERBOSE", True)).lower() == "true"  # global verbose mode
+ORT_CACHE_DIR = os.getenv("YOLOv5_ORT_CACHE_DIR")  # opt-in directory of optimized ONNX Runtime graphs
+OV_CACHE_DIR = os.getenv("YOLOv5_OV_CACHE_DIR")  # opt-in directory of compiled OpenVINO blobs
 TQDM_BAR_FORMAT = "{l_bar}{bar:10}{r_bar}"  # tqdm bar format
 FONT = "Arial.ttf"  # https://ultralytics.com/assets/Arial.ttf
+NMS_METHODS = "hard", "merge", "soft", "wbf"  # non_max_suppression() methods
 
 torch.set_printoptions(linewidth=320, precision=5, profile="long")
 np.set_printoptions(linewidth=320, formatter={"float_kind": "{:11.5g}".format})  # format short g, %precision=5
@@ -254,6 +260,103 @@ class WorkingDirectory(contextlib.ContextDecorator):
         os.chdir(self.cwd)
 
 
+class ResultsWriter:
+    # YOLOv5 background results writer. Usage: w = ResultsWriter(); w.text(f, lines); w.frame(); w.close()
+    def __init__(self, n=30, maxsize=32):
+        """Starts a writer thread that appends buffered txt/csv lines every `n` frames and encodes images and videos,
+        with at most `maxsize` queued operations so saving can not fall unboundedly behind inference.
+        """
+        self.n = n  # flush text buffers every n frames
+        self.frames = 0
+        self.lines, self.rows, self.videos = {}, {}, {}  # owned by the writer thread
+        self.q = queue.Queue(maxsize)
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def text(self, file, lines):
+        """Queues `lines` (str without newline) to append to a txt or JSON-lines `file`."""
+        self.q.put((self._text, (str(file), lines)))
+
+    def csv(self, file, rows):
+        """Queues `rows` (dicts) to append to a CSV `file`, writing a header if the file is new."""
+        self.q.put((self._csv, (str(file), rows)))
+
+    def image(self, file, im, increment=False):
+        """Queues BGR `im` to save to `file`, incrementing the name if it exists, i.e. for crops."""
+        self.q.put((self._image, (Path(file), im, increment)))
+
+    def video(self, i, file, im, fps, w, h):
+        """Queues BGR `im` as the next frame of video slot `i`, starting a new *.mp4 when `file` changes."""
+        self.q.put((self._video, (i, str(file), im, fps, w, h)))
+
+    def frame(self):
+        """Marks the end of a frame, flushing buffered lines every `n` frames."""
+        self.q.put((self._frame, ()))
+
+    def close(self):
+        """Flushes buffered lines, releases video writers and waits for the writer thread to finish."""
+        self.q.put(None)
+        self.thread.join()
+
+    def run(self):
+        """Runs queued write operations until close(), logging rather than raising write errors."""
+        for fn, args in iter(self.q.get, None):
+            try:
+                fn(*args)
+            except Exception as e:
+                LOGGER.warning(f"WARNING ⚠️ Results writer failed: {e}")
+        self.flush()
+        for _, vw in self.videos.values():
+            vw.release()
+
+    def flush(self):
+        """Appends buffered lines with one open() per file."""
+        for f, lines in self.lines.items():
+            with open(f, "a") as fh:
+                fh.writelines(f"{x}\n" for x in lines)
+        for f, rows in self.rows.items():
+            new = not Path(f).is_file()
+            with open(f, "a", newline="") as fh:
+                writer = csv.DictWriter(fh, fieldnames=rows[0].keys())
+                if new:
+                    writer.writeheader()
+                writer.writerows(rows)
+        self.lines, self.rows = {}, {}
+
+    def _text(self, file, lines):
+        """Buffers text lines for `file`."""
+        self.lines.setdefault(file, []).extend(lines)
+
+    def _csv(self, file, rows):
+        """Buffers CSV rows for `file`."""
+        if rows:
+            self.rows.setdefault(file, []).extend(rows)
+
+    def _image(self, file, im, increment):
+        """Encodes and saves an image."""
+        if increment:
+            file.parent.mkdir(parents=True, exist_ok=True)
+            file = increment_path(file)
+        cv2.imwrite(str(file), im)
+
+    def _video(self, i, file, im, fps, w, h):
+        """Encodes a video frame, (re)opening the writer of slot `i` on a new file."""
+        path, vw = self.videos.get(i, (None, None))
+        if path != file:  # new video
+            if vw is not None:
+                vw.release()  # release previous video writer
+            f = str(Path(file).with_suffix(".mp4"))  # force *.mp4 suffix on results videos
+            vw = cv2.VideoWriter(f, cv2.VideoWriter_fourcc(*"mp4v"), fps, (w, h))
+            self.videos[i] = file, vw
+        vw.write(im)
+
+    def _frame(self):
+        """Counts a frame, flushing every `n` frames."""
+        self.frames += 1
+        if self.frames % self.n == 0:
+            self.flush()
+
+
 def methods(instance):
     """Returns list of method names for a class/instance excluding dunder methods."""
     return [f for f in dir(instance) if callable(getattr(instance, f)) and not f.startswith("__")]
@@ -1014,9 +1117,11 @@ def non_max_suppression(
     labels=(),
     max_det=300,
     nm=0,  # number of masks
+    topk=0,  # keep top-k candidates per class per image before NMS, 0 to disable
+    method="hard",  # hard, merge (weighted mean of overlaps), soft (Gaussian Soft-NMS) or wbf (weighted boxes fusion)
 ):
     """
-    Non-Maximum Suppression (NMS) on inference results to reject overlapping detections.
+    Non-Maximum Suppression (NMS) on inference results to reject overlapping detections, batched over all images.
 
     Returns:
          list of detections, on (n,6) tensor per image [xyxy, conf, cls]
@@ -1025,6 +1130,7 @@ def non_max_suppression(
     # Checks
     assert 0 <= conf_thres <= 1, f"Invalid Confidence threshold {conf_thres}, valid values are between 0.0 and 1.0"
     assert 0 <= iou_thres <= 1, f"Invalid IoU {iou_thres}, valid values are between 0.0 and 1.0"
+    assert method in NMS_METHODS, f"Invalid NMS method {method}, valid values are {NMS_METHODS}"
     if isinstance(prediction, (list, tuple)):  # YOLOv5 model in validation model, output = (inference_out, loss_out)
         prediction = prediction[0]  # select only inference output
 
@@ -1038,86 +1144,163 @@ def non_max_suppression(
 
     # Settings
     # min_wh = 2  # (pixels) minimum box width and height
-    max_wh = 7680  # (pixels) maximum box width and height
-    max_nms = 30000  # maximum number of boxes into torchvision.ops.nms()
-    time_limit = 0.5 + 0.05 * bs  # seconds to quit after
-    redundant = True  # require redundant detections
+    max_nms = 30000  # maximum number of boxes per image into torchvision.ops.nms()
+    redundant = True  # require redundant detections (merge-NMS)
     multi_label &= nc > 1  # multiple labels per box (adds 0.5ms/img)
-    merge = False  # use merge-NMS
 
-    t = time.time()
     mi = 5 + nc  # mask start index
-    output = [torch.zeros((0, 6 + nm), device=prediction.device)] * bs
-    for xi, x in enumerate(prediction):  # image index, image inference
-        # Apply constraints
-        # x[((x[..., 2:4] < min_wh) | (x[..., 2:4] > max_wh)).any(1), 4] = 0  # width-height
-        x = x[xc[xi]]  # confidence
-
-        # Cat apriori labels if autolabelling
-        if labels and len(labels[xi]):
-            lb = labels[xi]
-            v = torch.zeros((len(lb), nc + nm + 5), device=x.device)
-            v[:, :4] = lb[:, 1:5]  # box
-            v[:, 4] = 1.0  # conf
-            v[range(len(lb)), lb[:, 0].long() + 5] = 1.0  # cls
-            x = torch.cat((x, v), 0)
-
-        # If none remain process next image
-        if not x.shape[0]:
-            continue
-
-        # Compute conf
-        x[:, 5:] *= x[:, 4:5]  # conf = obj_conf * cls_conf
-
-        # Box/Mask
-        box = xywh2xyxy(x[:, :4])  # center_x, center_y, width, height) to (x1, y1, x2, y2)
-        mask = x[:, mi:]  # zero columns if no masks
-
-        # Detections matrix nx6 (xyxy, conf, cls)
-        if multi_label:
-            i, j = (x[:, 5:mi] > conf_thres).nonzero(as_tuple=False).T
-            x = torch.cat((box[i], x[i, 5 + j, None], j[:, None].float(), mask[i]), 1)
-        else:  # best class only
-            conf, j = x[:, 5:mi].max(1, keepdim=True)
-            x = torch.cat((box, conf, j.float(), mask), 1)[conf.view(-1) > conf_thres]
-
-        # Filter by class
-        if classes is not None:
-            x = x[(x[:, 5:6] == torch.tensor(classes, device=x.device)).any(1)]
-
-        # Apply finite constraint
-        # if not torch.isfinite(x).all():
-        #     x = x[torch.isfinite(x).all(1)]
-
-        # Check shape
-        n = x.shape[0]  # number of boxes
-        if not n:  # no boxes
-            continue
-        x = x[x[:, 4].argsort(descending=True)[:max_nms]]  # sort by confidence and remove excess boxes
-
-        # Batched NMS
-        c = x[:, 5:6] * (0 if agnostic else max_wh)  # classes
-        boxes, scores = x[:, :4] + c, x[:, 4]  # boxes (offset by class), scores
-        i = torchvision.ops.nms(boxes, scores, iou_thres)  # NMS
-        i = i[:max_det]  # limit detections
-        if merge and (1 < n < 3e3):  # Merge NMS (boxes merged using weighted mean)
-            # update boxes as boxes(i,4) = weights(i,n) * boxes(n,4)
-            iou = box_iou(boxes[i], boxes) > iou_thres  # iou matrix
-            weights = iou * scores[None]  # box weights
-            x[i, :4] = torch.mm(weights, x[:, :4]).float() / weights.sum(1, keepdim=True)  # merged boxes
-            if redundant:
-                i = i[iou.sum(1) > 1]  # require redundancy
-
-        output[xi] = x[i]
-        if mps:
-            output[xi] = output[xi].to(device)
-        if (time.time() - t) > time_limit:
-            LOGGER.warning(f"WARNING ⚠️ NMS time limit {time_limit:.3f}s exceeded")
-            break  # time limit exceeded
-
+    b, k = xc.nonzero(as_tuple=True)  # image index, anchor index of candidates from all images
+    x = prediction[b, k]  # confidence
+
+    # Cat apriori labels if autolabelling
+    if labels and any(len(lb) for lb in labels):
+        v = torch.zeros((sum(len(lb) for lb in labels), nc + nm + 5), device=x.device)
+        lb = torch.cat([lb for lb in labels if len(lb)], 0)
+        v[:, :4] = lb[:, 1:5]  # box
+        v[:, 4] = 1.0  # conf
+        v[range(len(lb)), lb[:, 0].long() + 5] = 1.0  # cls
+        x = torch.cat((x, v), 0)
+        b = torch.cat((b, *(torch.full((len(lb),), i, device=b.device) for i, lb in enumerate(labels) if len(lb))))
+
+    # Compute conf
+    x[:, 5:] *= x[:, 4:5]  # conf = obj_conf * cls_conf
+
+    # Box/Mask
+    box = xywh2xyxy(x[:, :4])  # center_x, center_y, width, height) to (x1, y1, x2, y2)
+    mask = x[:, mi:]  # zero columns if no masks
+
+    # Detections matrix nx6 (xyxy, conf, cls)
+    if multi_label:
+        i, j = (x[:, 5:mi] > conf_thres).nonzero(as_tuple=False).T
+        x = torch.cat((box[i], x[i, 5 + j, None], j[:, None].float(), mask[i]), 1)
+        b = b[i]
+    else:  # best class only
+        conf, j = x[:, 5:mi].max(1, keepdim=True)
+        i = conf.view(-1) > conf_thres
+        x, b = torch.cat((box, conf, j.float(), mask), 1)[i], b[i]
+
+    # Filter by class
+    if classes is not None:
+        i = (x[:, 5:6] == torch.tensor(classes, device=x.device)).any(1)
+        x, b = x[i], b[i]
+
+    # Apply finite constraint
+    # if not torch.isfinite(x).all():
+    #     x = x[torch.isfinite(x).all(1)]
+
+    # Top-k pre-filter, caps candidates per (image, class) so crowded low-confidence outputs do not dominate NMS time
+    if topk:
+        c = x[:, 5].long()
+        x, g = rank_by_group(x, b * nc + c, bs * nc, topk)
+        b = g // nc
+
+    # Sort by image then confidence and remove excess boxes per image
+    x, b = rank_by_group(x, b, bs, max_nms)
+
+    # Batched NMS, boxes offset by (image, class) group so one call never suppresses across images or classes
+    if x.shape[0]:
+        g = b * (nc + 1) + x[:, 5].long() * (0 if agnostic else 1)  # (image, class) groups
+        span = x[:, :4].abs().max().double() + 1  # separation between groups
+        boxes = x[:, :4].double() + (g.double() * span)[:, None]  # float64 keeps IoU exact
+        scores = x[:, 4].double()
+        if method == "soft":  # Soft-NMS, O(n) memory per round
+            i, scores = soft_nms(boxes, scores, g, conf_thres, max_det)
+            x[i, 4] = scores.to(x.dtype)
+        else:
+            # NMS cost grows with the square of boxes per call, so only small groups share a call, as torchvision
+            # batched_nms() stops offsetting boxes above 1000 (CPU) or 5000 (CUDA) boxes
+            budget = 5000 if x.is_cuda else 1000  # boxes per nms() call
+            gs, j = g.sort()  # boxes of each group contiguous
+            n = torch.bincount(gs)  # boxes per group
+            chunk = ((n.cumsum(0) - n) // budget)[gs]  # groups starting in the same budget window share one call
+            i, start = [], 0
+            for nci in torch.bincount(chunk).tolist():
+                if nci:
+                    ci = j[start : start + nci]
+                    i.append(ci[torchvision.ops.nms(boxes[ci], scores[ci], iou_thres)])  # NMS
+                    start += nci
+            i = torch.cat(i)
+        if method in {"merge", "wbf"}:  # boxes merged using weighted mean
+            n = fuse_boxes(x, boxes, i, iou_thres, wbf=method == "wbf")
+            if method == "merge" and redundant:
+                i = i[n > 1]  # require redundancy
+        x, b = rank_by_group(x[i], b[i], bs, max_det)  # limit detections
+
+    output = list(x.to(device).split(torch.bincount(b, minlength=bs).tolist()))  # per-image (n,6) detections
     return output
 
 
+def soft_nms(boxes, scores, groups, conf_thres, max_det, sigma=0.5):
+    """Gaussian Soft-NMS for all (image, class) `groups` at once; each round keeps the best remaining box per group and
+    decays the others in its group by exp(-iou^2 / sigma). Returns kept indices and their decayed scores.
+    """
+    scores, alive, keep = scores.clone(), scores > conf_thres, []
+    best = torch.full((int(groups.max()) + 1,), -1, dtype=torch.long, device=groups.device)  # kept box per group
+    for _ in range(max_det):
+        if not alive.any():
+            break
+        i = (groups.double() * 4 - scores.masked_fill(~alive, -1)).argsort()  # by group then descending live score
+        first = torch.ones_like(i, dtype=torch.bool)
+        first[1:] = groups[i[1:]] != groups[i[:-1]]
+        i = i[first]
+        i = i[alive[i]]  # best live box of every group
+        keep.append(i)
+        alive[i] = False
+        best[groups[i]] = i
+        j = best[groups]
+        m = alive & (j >= 0)  # live boxes in groups that kept a box this round
+        iou = bbox_iou(boxes[m], boxes[j[m]], xywh=False).view(-1)
+        scores[m] *= torch.exp(-(iou**2) / sigma)
+        alive &= scores > conf_thres
+        best[groups[i]] = -1
+    i = torch.cat(keep) if keep else torch.zeros(0, dtype=torch.long, device=groups.device)
+    return i, scores[i]
+
+
+def fuse_boxes(x, boxes, i, iou_thres, wbf=False):
+    """
+    Replaces kept boxes x[i] with confidence-weighted means of the candidates overlapping them by more than `iou_thres`,
+    comparing `boxes` in blocks of candidates so memory stays bounded.
+
+    Merge-NMS averages every overlapping candidate into each kept box. WBF assigns each candidate only to its most
+    confident overlapping kept box and also averages confidences. Returns candidates fused per kept box.
+    """
+    k = len(i)
+    num = torch.zeros((k, 4), dtype=torch.double, device=x.device)  # weighted box sums
+    den = torch.zeros(k, dtype=torch.double, device=x.device)  # weight sums
+    n = torch.zeros(k, dtype=torch.double, device=x.device)  # counts
+    bs = max(1, 2**22 // k)  # candidates per block
+    for s in range(0, len(x), bs):
+        m = box_iou(boxes[s : s + bs], boxes[i]) > iou_thres  # (bs, k) overlaps
+        w, xy = x[s : s + bs, 4].double(), x[s : s + bs, :4].double()
+        if wbf:  # kept boxes are ordered by descending confidence within each group
+            v = m.any(1)
+            j = m[v].float().argmax(1)  # first overlapping kept box
+            num.index_add_(0, j, w[v, None] * xy[v])
+            den.index_add_(0, j, w[v])
+            n.index_add_(0, j, torch.ones_like(w[v]))
+        else:
+            wm = m.double() * w[:, None]
+            num += wm.T @ xy
+            den += wm.sum(0)
+            n += m.sum(0)
+    x[i, :4] = (num / den[:, None]).to(x.dtype)  # fused boxes
+    if wbf:
+        x[i, 4] = (den / n).to(x.dtype)  # mean confidence
+    return n
+
+
+def rank_by_group(x, g, ng, k):
+    """Sorts detections `x` (n,6+) with group indices `g` in [0, ng), i.e. images, by group then descending confidence,
+    keeping the top `k` per group.
+    """
+    i = (g.double() * 2 - x[:, 4].double()).argsort()  # conf in [0, 1], so group index dominates
+    x, g = x[i], g[i]
+    n = torch.bincount(g, minlength=ng)  # boxes per group
+    i = torch.arange(len(g), device=g.device) - (n.cumsum(0) - n)[g] < k  # rank within group
+    return x[i], g[i]
+
+
 def strip_optimizer(f="best.pt", s=""):
     """
     Strips optimizer and optionally saves checkpoint to finalize training; arguments are file path 'f' and save path
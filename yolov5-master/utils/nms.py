@@ -0,0 +1,193 @@
+# YOLOv5 🚀 by Ultralytics, AGPL-3.0 license
+"""
+Torch-free NumPy NMS and box utils for deploying ONNX, OpenVINO and TFLite exports without PyTorch or torchvision.
+
+Semantics match utils.general.non_max_suppression(), scale_boxes() and clip_boxes(). The greedy NMS kernel is compiled
+with Numba when it is installed.
+
+Usage:
+    import onnxruntime
+    from utils.nms import non_max_suppression, scale_boxes
+
+    session = onnxruntime.InferenceSession("yolov5s.onnx")
+    pred = session.run(None, {session.get_inputs()[0].name: im})[0]  # im (1,3,640,640) float32 0.0-1.0
+    det = non_max_suppression(pred, 0.25, 0.45)[0]  # (n,6) xyxy, conf, cls
+    det[:, :4] = scale_boxes(im.shape[2:], det[:, :4], im0.shape).round()
+"""
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def xywh2xyxy(x):
+    """Convert nx4 boxes from [x, y, w, h] to [x1, y1, x2, y2] where xy1=top-left, xy2=bottom-right."""
+    y = np.copy(x)
+    y[..., 0] = x[..., 0] - x[..., 2] / 2  # top left x
+    y[..., 1] = x[..., 1] - x[..., 3] / 2  # top left y
+    y[..., 2] = x[..., 0] + x[..., 2] / 2  # bottom right x
+    y[..., 3] = x[..., 1] + x[..., 3] / 2  # bottom right y
+    return y
+
+
+def clip_boxes(boxes, shape):
+    """Clips bounding box coordinates (xyxy) to fit within the specified image shape (height, width)."""
+    boxes[..., [0, 2]] = boxes[..., [0, 2]].clip(0, shape[1])  # x1, x2
+    boxes[..., [1, 3]] = boxes[..., [1, 3]].clip(0, shape[0])  # y1, y2
+
+
+def scale_boxes(img1_shape, boxes, img0_shape, ratio_pad=None):
+    """Rescales (xyxy) bounding boxes from img1_shape to img0_shape, optionally using provided `ratio_pad`."""
+    if ratio_pad is None:  # calculate from img0_shape
+        gain = min(img1_shape[0] / img0_shape[0], img1_shape[1] / img0_shape[1])  # gain  = old / new
+        pad = (img1_shape[1] - img0_shape[1] * gain) / 2, (img1_shape[0] - img0_shape[0] * gain) / 2  # wh padding
+    else:
+        gain = ratio_pad[0][0]
+        pad = ratio_pad[1]
+
+    boxes[..., [0, 2]] -= pad[0]  # x padding
+    boxes[..., [1, 3]] -= pad[1]  # y padding
+    boxes[..., :4] /= gain
+    clip_boxes(boxes, img0_shape)
+    return boxes
+
+
+def nms_loop(boxes, scores, iou_thres):
+    """Greedy NMS over (n,4) xyxy `boxes`, returning kept indices by descending score; compiled by Numba if present."""
+    order = np.argsort(-scores)
+    n = len(order)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    suppressed = np.zeros(n, dtype=np.bool_)
+    keep = np.empty(n, dtype=np.int64)
+    nk = 0
+    for a in range(n):
+        i = order[a]
+        if suppressed[i]:
+            continue
+        keep[nk] = i
+        nk += 1
+        for b in range(a + 1, n):
+            j = order[b]
+            if suppressed[j]:
+                continue
+            w = min(boxes[i, 2], boxes[j, 2]) - max(boxes[i, 0], boxes[j, 0])
+            h = min(boxes[i, 3], boxes[j, 3]) - max(boxes[i, 1], boxes[j, 1])
+            inter = max(w, 0.0) * max(h, 0.0)
+            if inter / (areas[i] + areas[j] - inter) > iou_thres:
+                suppressed[j] = True
+    return keep[:nk]
+
+
+def nms_numpy(boxes, scores, iou_thres):
+    """Greedy NMS over (n,4) xyxy `boxes`, vectorized against all remaining boxes per kept box."""
+    order = np.argsort(-scores)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    keep = []
+    while order.size:
+        i, rest = order[0], order[1:]
+        keep.append(i)
+        w = (np.minimum(boxes[i, 2], boxes[rest, 2]) - np.maximum(boxes[i, 0], boxes[rest, 0])).clip(0)
+        h = (np.minimum(boxes[i, 3], boxes[rest, 3]) - np.maximum(boxes[i, 1], boxes[rest, 1])).clip(0)
+        inter = w * h
+        with np.errstate(divide="ignore", invalid="ignore"):
+            order = rest[~(inter / (areas[i] + areas[rest] - inter) > iou_thres)]
+    return np.array(keep, dtype=np.int64)
+
+
+nms = numba.njit(cache=True, error_model="numpy")(nms_loop) if numba else nms_numpy  # as torchvision.ops.nms()
+
+
+def rank_by_group(x, g, ng, k):
+    """Sorts detections `x` (n,6+) with group indices `g` in [0, ng), i.e. images, by group then descending confidence,
+    keeping the top `k` per group.
+    """
+    i = np.lexsort((-x[:, 4], g))  # last key is primary
+    x, g = x[i], g[i]
+    n = np.bincount(g, minlength=ng)  # boxes per group
+    i = np.arange(len(g)) - (n.cumsum() - n)[g] < k  # rank within group
+    return x[i], g[i]
+
+
+def non_max_suppression(
+    prediction,
+    conf_thres=0.25,
+    iou_thres=0.45,
+    classes=None,
+    agnostic=False,
+    multi_label=False,
+    max_det=300,
+    nm=0,  # number of masks
+    topk=0,  # keep top-k candidates per class per image before NMS, 0 to disable
+):
+    """
+    Non-Maximum Suppression (NMS) on NumPy inference results to reject overlapping detections, batched over all images.
+
+    Returns:
+         list of detections, on (n,6) array per image [xyxy, conf, cls]
+    """
+
+    # Checks
+    assert 0 <= conf_thres <= 1, f"Invalid Confidence threshold {conf_thres}, valid values are between 0.0 and 1.0"
+    assert 0 <= iou_thres <= 1, f"Invalid IoU {iou_thres}, valid values are between 0.0 and 1.0"
+    if isinstance(prediction, (list, tuple)):  # multiple outputs, i.e. segmentation (detections, protos)
+        prediction = prediction[0]  # select only detection output
+
+    bs = prediction.shape[0]  # batch size
+    nc = prediction.shape[2] - nm - 5  # number of classes
+    max_nms = 30000  # maximum number of boxes per image into nms()
+    budget = 1000  # maximum boxes per nms() call, unless one (image, class) group is larger
+    multi_label &= nc > 1  # multiple labels per box
+
+    mi = 5 + nc  # mask start index
+    b, k = np.nonzero(prediction[..., 4] > conf_thres)  # image index, anchor index of candidates from all images
+    x = prediction[b, k].astype(np.float32)  # confidence, copied
+
+    # Compute conf
+    x[:, 5:] *= x[:, 4:5]  # conf = obj_conf * cls_conf
+
+    # Box/Mask
+    box = xywh2xyxy(x[:, :4])  # center_x, center_y, width, height) to (x1, y1, x2, y2)
+    mask = x[:, mi:]  # zero columns if no masks
+
+    # Detections matrix nx6 (xyxy, conf, cls)
+    if multi_label:
+        i, j = np.nonzero(x[:, 5:mi] > conf_thres)
+        x = np.concatenate((box[i], x[i, 5 + j, None], j[:, None].astype(np.float32), mask[i]), 1)
+        b = b[i]
+    else:  # best class only
+        j = x[:, 5:mi].argmax(1)
+        conf = np.take_along_axis(x[:, 5:mi], j[:, None], 1)
+        i = conf[:, 0] > conf_thres
+        x, b = np.concatenate((box, conf, j[:, None].astype(np.float32), mask), 1)[i], b[i]
+
+    # Filter by class
+    if classes is not None:
+        i = np.isin(x[:, 5], classes)
+        x, b = x[i], b[i]
+
+    # Top-k pre-filter
+    if topk:
+        x, g = rank_by_group(x, b * nc + x[:, 5].astype(np.int64), bs * nc, topk)
+        b = g // nc
+
+    # Sort by image then confidence and remove excess boxes per image
+    x, b = rank_by_group(x, b, bs, max_nms)
+
+    # Batched NMS, boxes offset by (image, class) group so one call never suppresses across images or classes
+    if len(x):
+        g = b * (nc + 1) + x[:, 5].astype(np.int64) * (0 if agnostic else 1)  # (image, class) groups
+        span = np.abs(x[:, :4]).max().astype(np.float64) + 1  # separation between groups
+        boxes = x[:, :4].astype(np.float64) + (g * span)[:, None]
+        scores = x[:, 4].astype(np.float64)
+        # NMS cost grows with the square of boxes per call, so only small groups share a call, as in the torch path
+        j = np.argsort(g, kind="stable")  # boxes of each group contiguous
+        n = np.bincount(g)  # boxes per group
+        chunk = ((n.cumsum() - n) // budget)[g[j]]  # groups starting in the same budget window share one call
+        chunks = np.split(j, np.flatnonzero(np.diff(chunk)) + 1)  # box indices per call
+        i = np.concatenate([ci[nms(boxes[ci], scores[ci], iou_thres)] for ci in chunks])  # NMS
+        x, b = rank_by_group(x[i], b[i], bs, max_det)  # limit detections
+
+    return np.split(x, np.bincount(b, minlength=bs).cumsum()[:-1])  # per-image (n,6) detections
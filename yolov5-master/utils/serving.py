@@ -0,0 +1,237 @@
+# YOLOv5 🚀 by Ultralytics, AGPL-3.0 license
+"""Dynamic micro-batching of concurrent inference requests and an LRU registry for serving AutoShape models."""
+
+import gc
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from pathlib import Path
+from queue import Empty, Queue
+from threading import Lock, Thread
+
+import numpy as np
+import torch
+
+from models.common import AutoShape, DetectMultiBackend
+from utils.general import LOGGER
+from utils.torch_utils import select_device
+
+
+class MicroBatcher:
+    """
+    Gathers images submitted by concurrent request threads into micro-batches, runs one batched AutoShape forward per
+    batch on a single worker thread and fans the per-image Detections back out.
+
+    A batch closes at `max_batch` images or `max_wait` seconds after its first image, whichever comes first.
+
+    Usage:
+        batcher = MicroBatcher(torch.hub.load("ultralytics/yolov5", "yolov5s"), max_batch=8, max_wait=0.002)
+        results = batcher(Image.open("zidane.jpg"))  # Detections for one image, callable from any thread
+        batcher.metrics()  # latency percentiles, queue depth and batch sizes
+    """
+
+    def __init__(self, model, size=640, max_batch=8, max_wait=0.002, maxsize=1024, window=1000):
+        """Starts the batching thread for AutoShape `model`, keeping metrics over the last `window` requests."""
+        self.model = model
+        self.size = size  # inference size
+        self.max_batch = max_batch  # maximum images per forward
+        self.max_wait = max_wait  # seconds to wait for a batch to fill
+        self.q = Queue(maxsize)  # (image, future, submit time), blocks submitters when full
+        self.lock = Lock()  # guards metrics
+        self.n = 0  # requests served
+        self.latency = deque(maxlen=window)  # seconds, submit to result
+        self.wait = deque(maxlen=window)  # seconds, submit to batch start
+        self.batches = deque(maxlen=window)  # images per forward
+        self.closed = False
+        self.closing = Lock()  # orders submit() against close()
+        self.thread = Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def __call__(self, im, timeout=None):
+        """Runs inference on one image (any AutoShape input), blocking until its Detections are ready."""
+        return self.submit(im).result(timeout)
+
+    def submit(self, im):
+        """Queues one image and returns a concurrent.futures.Future resolving to its Detections."""
+        future = Future()
+        with self.closing:
+            if self.closed:
+                raise RuntimeError("MicroBatcher is closed")
+            self.q.put((im, future, time.perf_counter()))
+        return future
+
+    def close(self):
+        """Stops accepting images and waits for queued images to be served."""
+        with self.closing:
+            self.closed = True
+            self.q.put(None)  # stop after everything queued before it
+        self.thread.join()
+
+    def run(self):
+        """Collects micro-batches from the queue and runs them until close()."""
+        stop = False
+        while not stop:
+            batch = [self.q.get()]  # block for the first image
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch and batch[-1] is not None:
+                try:
+                    batch.append(self.q.get(timeout=max(deadline - time.perf_counter(), 0)))
+                except Empty:
+                    break
+            stop = batch[-1] is None  # close() sentinel
+            batch = [b for b in batch if b is not None and b[1].set_running_or_notify_cancel()]  # drop cancelled
+            if batch:
+                self.forward(batch)
+
+    def forward(self, batch):
+        """Runs one batched forward for `batch` of (image, future, submit time) and resolves the futures."""
+        ims, futures, t0 = zip(*batch)
+        t1 = time.perf_counter()
+        try:
+            results = self.model(list(ims), size=self.size).tolist()  # per-image Detections
+        except Exception as e:
+            for f in futures:
+                f.set_exception(e)
+            return
+        for f, r in zip(futures, results):
+            f.set_result(r)
+        t2 = time.perf_counter()
+        with self.lock:
+            self.n += len(batch)
+            self.latency.extend(t2 - t for t in t0)
+            self.wait.extend(t1 - t for t in t0)
+            self.batches.append(len(batch))
+
+    def metrics(self):
+        """Returns queue depth, requests served, mean batch size and latency/queue-wait percentiles in milliseconds."""
+        with self.lock:
+            latency, wait, batches = np.array(self.latency) * 1e3, np.array(self.wait) * 1e3, np.array(self.batches)
+            n = self.n
+        q = (50, 90, 99)  # percentiles
+        return {
+            "queue_depth": self.q.qsize(),
+            "requests": n,
+            "batch_size_mean": round(float(batches.mean()), 2) if len(batches) else 0.0,
+            "latency_ms": {f"p{k}": round(float(v), 2) for k, v in zip(q, np.percentile(latency, q))} if n else {},
+            "queue_wait_ms": {f"p{k}": round(float(v), 2) for k, v in zip(q, np.percentile(wait, q))} if n else {},
+        }
+
+
+class ModelRegistry:
+    """
+    Loads models from local weights on first request and shares one DetectMultiBackend, wrapped in AutoShape and a
+    MicroBatcher, per weights file. Least recently used models are evicted once resident models exceed `budget` bytes.
+
+    Usage:
+        registry = ModelRegistry("weights", budget=4e9)
+        results = registry.submit("yolov5s", im).result()  # loads weights/yolov5s.pt on first use
+        registry.metrics()  # resident models, load and eviction timings
+    """
+
+    def __init__(self, weights_dir="weights", device="", budget=4e9, size=640, max_batch=8, max_wait=0.002, half=False):
+        """Initializes an empty registry serving weights from `weights_dir` on `device` within `budget` bytes."""
+        from export import export_formats
+
+        self.dir = Path(weights_dir).resolve()
+        self.suffixes = tuple(export_formats().Suffix)  # *.pt and exported models, i.e. .onnx or _openvino_model
+        self.device = select_device(device)
+        self.budget = budget  # bytes of resident models, the most recently used model is always kept
+        self.half = half
+        self.kwargs = dict(size=size, max_batch=max_batch, max_wait=max_wait)  # MicroBatcher arguments
+        self.models = OrderedDict()  # weights: {"batcher", "bytes", "load_ms", "used"}, least recently used first
+        self.lock = Lock()  # guards models and events
+        self.loading = {}  # weights: Lock, one load per weights file while other models keep serving
+        self.events = deque(maxlen=100)  # recent loads and evictions
+
+    def resolve(self, name):
+        """Returns the weights file for model `name`, i.e. 'yolov5s' or 'yolov5s.onnx', inside the weights directory."""
+        for f in self.dir / name, self.dir / f"{name}.pt":
+            f = f.resolve()
+            if f.parent == self.dir and f.name.endswith(self.suffixes) and f.exists():
+                return str(f)
+        raise FileNotFoundError(f"model '{name}' not found in {self.dir}")
+
+    def get(self, name):
+        """Returns the MicroBatcher serving model `name`, loading it and evicting others if needed."""
+        w = self.resolve(name)
+        with self.lock:
+            if w in self.models:
+                return self.use(w)
+            loading = self.loading.setdefault(w, Lock())
+        with loading:
+            with self.lock:
+                if w in self.models:  # loaded by a concurrent request
+                    return self.use(w)
+            try:
+                t = time.perf_counter()
+                model = DetectMultiBackend(w, device=self.device, fp16=self.half)
+                n = sum(x.numel() * x.element_size() for x in (*model.parameters(), *model.buffers()))
+                if not model.pt:  # exported backends, size on disk
+                    f = Path(w)
+                    n = sum(x.stat().st_size for x in (f.rglob("*") if f.is_dir() else [f]) if x.is_file())
+                autoshape = AutoShape(model, verbose=False)
+                onnx_dynamic = model.onnx and isinstance(model.session.get_inputs()[0].shape[0], str)  # batch axis
+                nb = self.kwargs["max_batch"] if model.pt or model.jit or onnx_dynamic else 1  # batch sizes served
+                autoshape.warmup(self.kwargs["size"], range(1, nb + 1))
+                batcher = MicroBatcher(autoshape, **self.kwargs)
+                dt = (time.perf_counter() - t) * 1e3
+                LOGGER.info(f"Loaded {w} ({n / 1e6:.1f} MB) in {dt:.1f}ms")
+                with self.lock:
+                    self.models[w] = {"batcher": batcher, "bytes": n, "load_ms": round(dt, 1), "used": time.time()}
+                    self.events.append({"event": "load", "weights": w, "ms": round(dt, 1)})
+                    evict = []
+                    while len(self.models) > 1 and sum(m["bytes"] for m in self.models.values()) > self.budget:
+                        evict.append(self.models.popitem(last=False))  # least recently used
+            finally:  # also after a failed load, so the next request retries it
+                with self.lock:
+                    self.loading.pop(w, None)
+        while evict:
+            self.evict(*evict.pop())
+        return batcher
+
+    def use(self, w):
+        """Marks model `w` as most recently used and returns its MicroBatcher, called with the lock held."""
+        self.models.move_to_end(w)
+        self.models[w]["used"] = time.time()
+        return self.models[w]["batcher"]
+
+    def evict(self, w, m):
+        """Stops the MicroBatcher of evicted model `w` once its queued images are served and frees its memory."""
+        t = time.perf_counter()
+        idle = time.time() - m["used"]
+        batcher = m.pop("batcher")  # last reference to the model
+        batcher.close()
+        del batcher
+        gc.collect()
+        if self.device.type == "cuda":
+            torch.cuda.empty_cache()
+        dt = (time.perf_counter() - t) * 1e3
+        LOGGER.info(f"Evicted {w} after {idle:.1f}s idle in {dt:.1f}ms")
+        with self.lock:
+            self.events.append({"event": "evict", "weights": w, "ms": round(dt, 1)})
+
+    def submit(self, name, im):
+        """Queues image `im` for model `name` and returns a Future resolving to its Detections."""
+        while True:
+            batcher = self.get(name)
+            try:
+                return batcher.submit(im)
+            except RuntimeError:
+                if not batcher.closed:
+                    raise
+                # evicted between get() and submit(), load again
+
+    def metrics(self):
+        """Returns resident models with their batching metrics, memory use against the budget and recent events."""
+        with self.lock:
+            models = list(self.models.items())
+            events = list(self.events)
+        return {
+            "resident_mb": round(sum(m["bytes"] for _, m in models) / 1e6, 1),
+            "budget_mb": round(self.budget / 1e6, 1),
+            "models": {
+                w: {"mb": round(m["bytes"] / 1e6, 1), "load_ms": m["load_ms"], **m["batcher"].metrics()}
+                for w, m in models
+            },
+            "events": events,
+        }
@@ -38,9 +38,10 @@ ROOT = Path(os.path.relpath(ROOT, Path.cwd()))  # relative
 
 from models.common import DetectMultiBackend
 from utils.callbacks import Callbacks
-from utils.dataloaders import create_dataloader
+from utils.dataloaders import BatchPrefetcher, create_dataloader
 from utils.general import (
     LOGGER,
+    NMS_METHODS,
     TQDM_BAR_FORMAT,
     Profile,
     check_dataset,
@@ -126,7 +127,9 @@ def run(
     conf_thres=0.001,  # confidence threshold
     iou_thres=0.6,  # NMS IoU threshold
     max_det=300,  # maximum detections per image
-    task="val",  # train, val, test, speed or study
+    topk=0,  # NMS top-k candidates per class pre-filter, 0 to disable
+    nms_method="hard",  # NMS method, hard, merge, soft or wbf
+    task="val",  # train, val, test, speed, study or nms
     device="",  # cuda device, i.e. 0 or 0,1,2,3 or cpu
     workers=8,  # max dataloader workers (per RANK in DDP mode)
     single_cls=False,  # treat as single-class dataset
@@ -179,7 +182,6 @@ def run(
 
     # Configure
     model.eval()
-    cuda = device.type != "cpu"
     is_coco = isinstance(data.get("val"), str) and data["val"].endswith(f"coco{os.sep}val2017.txt")  # COCO dataset
     nc = 1 if single_cls else int(data["nc"])  # number of classes
     iouv = torch.linspace(0.5, 0.95, 10, device=device)  # iou vector for mAP@0.5:0.95
@@ -193,7 +195,6 @@ def run(
                 f"{weights} ({ncm} classes) trained on different --data than what you passed ({nc} "
                 f"classes). Pass correct combination of --weights and --data that are trained together."
             )
-        model.warmup(imgsz=(1 if pt else batch_size, 3, imgsz, imgsz))  # warmup
         pad, rect = (0.0, False) if task == "speed" else (0.5, pt)  # square inference for benchmarks
         task = task if task in ("train", "val", "test") else "val"  # path to train/val/test images
         dataloader = create_dataloader(
@@ -207,6 +208,12 @@ def run(
             workers=workers,
             prefix=colorstr(f"{task}: "),
         )[0]
+        dataset = dataloader.dataset
+        if rect:  # warmup every letterboxed batch shape, including a smaller last batch
+            model.warmup(imgsz=[(n, 3, *s) for n, s in zip(np.bincount(dataset.batch), dataset.batch_shapes)])
+        else:  # full batches and a smaller last batch, non-PyTorch backends build each batch shape
+            b = [batch_size, len(dataset) % batch_size or batch_size]
+            model.warmup(imgsz=[(1 if pt else n, 3, imgsz, imgsz) for n in b])  # warmup
 
     seen = 0
     confusion_matrix = ConfusionMatrix(nc=nc)
@@ -220,16 +227,12 @@ def run(
     loss = torch.zeros(3, device=device)
     jdict, stats, ap, ap_class = [], [], [], []
     callbacks.run("on_val_start")
-    pbar = tqdm(dataloader, desc=s, bar_format=TQDM_BAR_FORMAT)  # progress bar
+    prefetcher = BatchPrefetcher(dataloader, device, half=half)  # device transfer and normalization on a thread
+    pbar = tqdm(prefetcher, desc=s, bar_format=TQDM_BAR_FORMAT)  # progress bar
     for batch_i, (im, targets, paths, shapes) in enumerate(pbar):
         callbacks.run("on_val_batch_start")
-        with dt[0]:
-            if cuda:
-                im = im.to(device, non_blocking=True)
-                targets = targets.to(device)
-            im = im.half() if half else im.float()  # uint8 to fp16/32
-            im /= 255  # 0 - 255 to 0.0 - 1.0
-            nb, _, height, width = im.shape  # batch size, channels, height, width
+        dt[0].t = prefetcher.t  # data wait
+        nb, _, height, width = im.shape  # batch size, channels, height, width
 
         # Inference
         with dt[1]:
@@ -244,7 +247,15 @@ def run(
         lb = [targets[targets[:, 0] == i, 1:] for i in range(nb)] if save_hybrid else []  # for autolabelling
         with dt[2]:
             preds = non_max_suppression(
-                preds, conf_thres, iou_thres, labels=lb, multi_label=True, agnostic=single_cls, max_det=max_det
+                preds,
+                conf_thres,
+                iou_thres,
+                labels=lb,
+                multi_label=True,
+                agnostic=single_cls,
+                max_det=max_det,
+                topk=topk,
+                method=nms_method,
             )
 
         # Metrics
@@ -372,7 +383,9 @@ def parse_opt():
     parser.add_argument("--conf-thres", type=float, default=0.001, help="confidence threshold")
     parser.add_argument("--iou-thres", type=float, default=0.6, help="NMS IoU threshold")
     parser.add_argument("--max-det", type=int, default=300, help="maximum detections per image")
-    parser.add_argument("--task", default="val", help="train, val, test, speed or study")
+    parser.add_argument("--topk", type=int, default=0, help="NMS top-k candidates per class pre-filter, 0 to disable")
+    parser.add_argument("--nms-method", default="hard", choices=NMS_METHODS, help="NMS method")
+    parser.add_argument("--task", default="val", help="train, val, test, speed, study or nms")
     parser.add_argument("--device", default="", help="cuda device, i.e. 0 or 0,1,2,3 or cpu")
     parser.add_argument("--workers", type=int, default=8, help="max dataloader workers (per RANK in DDP mode)")
     parser.add_argument("--single-cls", action="store_true", help="treat as single-class dataset")
@@ -429,8 +442,21 @@ def main(opt):
                 np.savetxt(f, y, fmt="%10.4g")  # save
             subprocess.run(["zip", "-r", "study.zip", "study_*.txt"])
             plot_val_study(x=x)  # plot
+
+        elif opt.task == "nms":  # NMS top-k latency vs mAP benchmarks
+            # python val.py --task nms --data coco.yaml --weights yolov5s.pt
+            for opt.weights in weights:
+                f = f"nms_{Path(opt.data).stem}_{Path(opt.weights).stem}.txt"  # filename to save to
+                x, y = [0, 1000, 300, 100, 30, 10], []  # x axis (top-k, 0 is no pre-filter), y axis
+                for opt.topk in x:
+                    LOGGER.info(f"\nRunning {f} --topk {opt.topk}...")
+                    r, _, t = run(**vars(opt), plots=False)
+                    y.append((opt.topk, *r[:4], *t))  # top-k, P, R, mAP50, mAP50-95, times
+                np.savetxt(f, y, fmt="%10.4g")  # save
+                s = ("%10s" * 4) % ("top-k", "mAP50", "mAP50-95", "NMS ms")
+                LOGGER.info("\n".join([s] + [("%10s" + "%10.4g" * 3) % (k or "all", *v[2:4], v[-1]) for k, *v in y]))
         else:
-            raise NotImplementedError(f'--task {opt.task} not in ("train", "val", "test", "speed", "study")')
+            raise NotImplementedError(f'--task {opt.task} not in ("train", "val", "test", "speed", "study", "nms")')
 
 
 if __name__ == "__main__":